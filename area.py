@@ -2,6 +2,8 @@ from shapepoint import ShapePoint
 import util
 
 class Area:
+    __slots__ = ('top_left', 'bottom_right')
+
     def __init__(self, tl = None, br = None):
         self.top_left = ShapePoint(tl) if tl is None else ShapePoint(tl.lat, tl.lon)
         self.bottom_right = ShapePoint() if br is None else ShapePoint(br.lat, br.lon)
@@ -89,4 +91,5 @@ class Area:
         return (lat >= self.bottom_right.lat and lat <= self.top_left.lat
             and lon <= self.bottom_right.lon and lon >= self.top_left.lon)
 
-
+    def get_center(self):
+        return ShapePoint((self.top_left.lat + self.bottom_right.lat) / 2, (self.top_left.lon + self.bottom_right.lon) / 2)
@@ -0,0 +1,113 @@
+"""
+Uploads the same simulated run of positions to a server once per position, as
+graas-bt.py does by default, and in batches (batch_size/batch_seconds config
+properties), reporting requests, bytes on the wire and signing time per position,
+e.g.:
+
+    python mock-server.py
+    python batch-bench.py https://localhost:8443/ 300 15 /tmp/tmpXXXX/cert.pem
+
+The simulated trip id changes every 100 positions, which flushes a batch early.
+"""
+
+import ecdsa
+import json
+import log
+import random
+import sys
+import time
+import util
+from hashlib import sha256
+from position_batch import PositionBatch
+from uploader import Uploader
+
+TRIP_LENGTH = 100 # positions
+
+def get_positions(count):
+    positions = []
+    lat = 37.7749
+    lon = -122.4194
+    t = int(time.time())
+
+    for i in range(count):
+        lat += random.uniform(-.0002, .0002)
+        lon += random.uniform(-.0002, .0002)
+        positions.append({
+            'timestamp': t + 2 * i,
+            'lat': round(lat, 6),
+            'long': round(lon, 6),
+            'speed': round(random.uniform(0, 15), 2),
+            'heading': random.randint(0, 359),
+            'accuracy': round(random.uniform(2, 10), 1),
+            'trip-id': f'trip-{i // TRIP_LENGTH}',
+            'pos-timestamp': t + 2 * i
+        })
+
+    return positions
+
+def get_header(position):
+    return {
+        'uuid': '00000000-0000-0000-0000-000000000000',
+        'agent': 'raspberry bench graas 0.1 (gulper)',
+        'timestamp': position['timestamp'],
+        'agency-id': 'bench-agency',
+        'vehicle-id': 'bench-vehicle'
+    }
+
+def sign_message(msg, sk, stats):
+    start = time.perf_counter()
+    data = json.dumps(msg, separators=(',', ':'))
+    sig = util.sign(data, sk)
+    data = json.dumps({'data': msg, 'sig': sig}, separators=(',', ':')).encode('utf-8')
+    stats['sign'] += time.perf_counter() - start
+    return data
+
+def run_single(uploader, sk, positions, batch_size, stats):
+    for p in positions:
+        msg = get_header(p)
+        msg.update(p)
+        uploader.post('new-pos-sig', sign_message(msg, sk, stats))
+
+def run_batched(uploader, sk, positions, batch_size, stats):
+    # batch_seconds is left out, simulated positions come in faster than real time
+    batch = PositionBatch(batch_size, float('inf'))
+
+    for p in positions:
+        if batch.add(p):
+            msg = get_header(p)
+            msg['positions'] = batch.take()
+            uploader.post('new-pos-batch', sign_message(msg, sk, stats), True)
+
+    if len(batch) > 0:
+        msg = get_header(positions[-1])
+        msg['positions'] = batch.take()
+        uploader.post('new-pos-batch', sign_message(msg, sk, stats), True)
+
+def main(url, count, batch_size, verify):
+    sk = ecdsa.SigningKey.generate(curve = ecdsa.NIST256p, hashfunc = sha256)
+    positions = get_positions(count)
+
+    print(f'{"mode":<10} {"requests":>9} {"req/s":>8} {"bytes/pos":>10} {"sign ms/pos":>12} {"wall s":>8}')
+
+    for name, run in [('single', run_single), (f'batch {batch_size}', run_batched)]:
+        uploader = Uploader(url, verify = verify)
+        stats = {'sign': 0}
+        start = time.perf_counter()
+        run(uploader, sk, positions, batch_size, stats)
+        elapsed = time.perf_counter() - start
+        uploader.close()
+
+        s = uploader.stats
+        print(f'{name:<10} {s.requests:>9} {s.requests / elapsed:>8.1f} {s.bytes_sent / count:>10.1f} {1000 * stats["sign"] / count:>12.2f} {elapsed:>8.2f}')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(f'usage: {sys.argv[0]} <server-url> <position-count> <batch-size> [<cert-file>]')
+        exit(1)
+
+    url = sys.argv[1]
+    if url.rfind('/') != len(url) - 1:
+        url += '/'
+
+    log.set_level(log.WARNING)
+    main(url, int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] if len(sys.argv) > 4 else True)
@@ -10,6 +10,18 @@ standard config properties are:
 - agency_gtfs_id
 - vehicle_id
 - static_gtfs_url
+
+optional properties are:
+- stop_time_delay_tolerance: delay change in seconds below which stop time entities aren't uploaded again
+- max_cell_segments: number of trip segments above which a grid cell gets split
+- gps_interval: seconds between GPS samples, defaults to 2
+- pipeline_queue_size: number of fixes and uploads that can queue up before the oldest are dropped
+- outbox_max_size: MB of unsent positions to keep on disk, defaults to 16
+- outbox_max_age: seconds after which unsent positions are discarded, defaults to 6 hours
+- batch_size: if set, positions are uploaded in batches of this many, defaults to 15 if only batch_seconds is set
+- batch_seconds: if set, positions are uploaded in batches spanning at most this many seconds, defaults to 30
+- gps_polling: if set, the GPS modem is polled with AT+CGPSINFO instead of streaming NMEA,
+  both produce fixes with speed in m/s and UTC timestamps
 """
 class Config:
     SEPARATOR = ': '
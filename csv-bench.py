@@ -0,0 +1,130 @@
+"""
+Compares the streaming CSV engine in csv.py against the previous
+character-by-character parser on a table from a GTFS archive, e.g.:
+
+    python csv-bench.py ~/tmp/gtfs-cache/gtfs.zip stop_times.txt trip_id,arrival_time,stop_id
+"""
+
+import csv
+import io
+import sys
+import tracemalloc
+import util
+from zipfile import ZipFile
+
+# previous parser, kept here verbatim as the baseline
+def legacy_parse(names, line):
+    result = {}
+    ci = 0
+    s = ''
+    i = 0
+
+    while i < len(line):
+        c = line[i]
+
+        if c == ',':
+            result[names[ci]] = s
+            ci += 1
+            s = ''
+            i += 1
+            continue
+
+        if c == '"':
+            i += 1
+            while i < len(line):
+                c = line[i]
+                if c == '"':
+                    if i + 1 < len(line) and line[i + 1] == '"':
+                        s += '"'
+                        i += 2
+                        continue
+                    else:
+                        i += 1
+                        break
+                s += c
+                i += 1
+            continue
+
+        s += c
+        i += 1
+
+    result[names[ci]] = s
+    return result
+
+class LegacyDictReader:
+    def __init__(self, f):
+        s = f.readline()
+
+        if s.startswith('\ufeff'):
+            s = s[1:]
+
+        s = s.strip()
+
+        self.names = s.split(',')
+        self.rows = []
+        self.rowIndex = 0
+
+        while True:
+            line = f.readline()
+            if not line:
+                break
+
+            line = line.strip()
+            if (len(line) == 0):
+                continue
+
+            self.rows.append(legacy_parse(self.names, line))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.rowIndex >= len(self.rows):
+            raise StopIteration
+
+        row = self.rows[self.rowIndex]
+        self.rowIndex += 1
+        return row
+
+def run(name, make_reader, text):
+    tracemalloc.start()
+    start = util.now()
+    count = 0
+
+    for r in make_reader(io.StringIO(text)):
+        count += 1
+
+    elapsed = util.now() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f'{name:<24} rows: {count:>9}  time: {elapsed:>7} ms  peak: {int(peak / 1024):>8} KB')
+    return elapsed
+
+def main(zip_path, table, columns):
+    with ZipFile(zip_path) as z:
+        text = z.read(table).decode('utf-8')
+
+    print(f'- table: {table} ({int(len(text) / 1024)} KB)')
+    print(f'- columns: {columns}')
+
+    t1 = run('legacy DictReader', LegacyDictReader, text)
+    t2 = run('streaming DictReader', csv.DictReader, text)
+    t3 = run('streaming, projected', lambda f: csv.DictReader(f, columns), text)
+
+    print(f'- speedup: {t1 / max(t2, 1):.1f}x, projected: {t1 / max(t3, 1):.1f}x')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} <gtfs-zip> [<table-name> [<column>,<column>,...]]')
+        exit(1)
+
+    table = 'stop_times.txt'
+    if len(sys.argv) > 2:
+        table = sys.argv[2]
+
+    columns = ['trip_id', 'arrival_time', 'stop_id', 'stop_sequence']
+    if len(sys.argv) > 3:
+        columns = sys.argv[3].split(',')
+
+    main(sys.argv[1], table, columns)
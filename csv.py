@@ -1,81 +1,117 @@
-def parse(names, line):
-    result = {}
-    ci = 0
-    s = ''
+"""
+Streaming CSV parser for GTFS tables.
+
+Lines without quotes take a fast path through str.split(). Quoted fields follow the
+same rules as before: a quote opens a quoted run that may contain commas, a doubled
+quote inside a quoted run yields a literal quote, and quoted and unquoted runs can be
+mixed within one field.
+
+Readers can be given a list of column names to project rows onto, in which case
+only those columns end up in the row dicts. Requested columns that are missing
+from the header are left out of the rows, so callers can use r.get() for optional
+attributes.
+"""
+
+def split(line):
+    if not '"' in line:
+        return line.split(',')
+
+    return split_quoted(line)
+
+def split_quoted(line):
+    fields = []
+    chunks = []
     i = 0
+    n = len(line)
 
-    while i < len(line):
-        c = line[i]
+    while True:
+        comma = line.find(',', i)
+        quote = line.find('"', i)
 
-        if c == ',':
-            result[names[ci]] = s
-            ci += 1
-            s = ''
-            i += 1
-            continue
+        if quote >= 0 and (comma < 0 or quote < comma):
+            chunks.append(line[i:quote])
+            i = quote + 1
+
+            while True:
+                quote = line.find('"', i)
+
+                if quote < 0:
+                    # unterminated quote, rest of line is part of field
+                    chunks.append(line[i:])
+                    i = n
+                    break
+
+                chunks.append(line[i:quote])
+
+                if quote + 1 < n and line[quote + 1] == '"':
+                    chunks.append('"')
+                    i = quote + 2
+                    continue
+
+                i = quote + 1
+                break
 
-        if c == '"':
-            i += 1
-            while i < len(line):
-                c = line[i]
-                if c == '"':
-                    if i + 1 < len(line) and line[i + 1] == '"':
-                        s += '"'
-                        i += 2
-                        continue
-                    else:
-                        i += 1
-                        break
-                s += c
-                i += 1
             continue
 
-        s += c
-        i += 1
+        if comma < 0:
+            chunks.append(line[i:])
+            fields.append(''.join(chunks))
+            return fields
+
+        chunks.append(line[i:comma])
+        fields.append(''.join(chunks))
+        chunks = []
+        i = comma + 1
+
+def parse(names, line):
+    return dict(zip(names, split(line)))
+
+class CSVLine:
+    def __init__(self, s, columns = None):
+        self.names = split(s)
+        self.columns = None
+
+        if columns is not None:
+            self.columns = [(n, self.names.index(n)) for n in columns if n in self.names]
+
+    def parse(self, line):
+        fields = split(line)
 
-    result[names[ci]] = s
-    return result
+        if self.columns is None:
+            return dict(zip(self.names, fields))
+
+        count = len(fields)
+        return {n: fields[i] for n, i in self.columns if i < count}
 
 class DictReader:
-    def __init__(self, f):
+    def __init__(self, f, columns = None):
         s = f.readline()
 
         # utf-8 BOM
         if s.startswith('\ufeff'):
             s = s[1:]
 
-        s = s.strip()
+        self.f = f
+        self.csvline = CSVLine(s.strip(), columns)
+        self.names = self.csvline.names
 
-        self.names = s.split(',')
-        self.rows = []
-        self.rowIndex = 0
+    def __iter__(self):
+        return self
 
+    def __next__(self):
         while True:
-            line = f.readline()
+            line = self.f.readline()
             if not line:
-                break
+                raise StopIteration
 
             line = line.strip()
-            if (len(line) == 0):
+            if len(line) == 0:
                 continue
 
-            self.rows.append(parse(self.names, line))
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.rowIndex >= len(self.rows):
-            raise StopIteration
-
-        row = self.rows[self.rowIndex]
-        self.rowIndex += 1
-        return row
-
-class CSVLine:
-    def __init__(self, s):
-        self.names = s.split(',')
-
-    def parse(self, line):
-        return parse(self.names, line)
+            return self.csvline.parse(line)
 
+def read(f, columns = None):
+    """
+    Generator that yields the rows of CSV file object `f` as dicts.
+    """
+    yield from DictReader(f, columns)
@@ -0,0 +1,103 @@
+"""
+Microbenchmarks for the batch distance functions in util and geo_util, comparing
+them against the scalar loops they replace, with and without NumPy:
+
+    python geo-bench.py [<points>...]
+"""
+
+import geo_util
+import random
+import sys
+import time
+import util
+
+LAT = 36.2
+LON = -119.3
+
+def get_points(count):
+    lats = []
+    lons = []
+    lat = LAT
+    lon = LON
+
+    for i in range(count):
+        lat += random.uniform(-.001, .001)
+        lon += random.uniform(-.001, .001)
+        lats.append(lat)
+        lons.append(lon)
+
+    return lats, lons
+
+def run(fn, min_seconds = .2):
+    count = 0
+    start = time.perf_counter()
+
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+
+    return elapsed / count * 1000000
+
+def scalar_lengths(lats, lons):
+    return sum(util.haversine_distance(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(len(lats) - 1))
+
+def scalar_from(lats, lons):
+    return min(util.haversine_distance(LAT, LON, lats[i], lons[i]) for i in range(len(lats)))
+
+def scalar_polyline(lats, lons):
+    min_distance = float('inf')
+
+    for i in range(len(lats) - 1):
+        sp1 = {'lat': lats[i], 'lon': lons[i]}
+        sp2 = {'lat': lats[i + 1], 'lon': lons[i + 1]}
+        min_distance = min(min_distance, geo_util.get_min_distance(sp1, sp2, LAT, LON, 0))
+
+    return min_distance
+
+def main(sizes):
+    np = util.np
+    print(f'- numpy: {"n/a" if np is None else np.__version__}')
+    print(f'{"points":>8} {"function":<28} {"scalar":>10} {"python":>10} {"numpy":>10} {"speedup":>8}')
+
+    for count in sizes:
+        lats, lons = get_points(count)
+
+        cases = [
+            ('consecutive distances', lambda: scalar_lengths(lats, lons), lambda: util.haversine_distances(lats, lons)),
+            ('one-to-many min distance', lambda: scalar_from(lats, lons), lambda: util.haversine_min_distance(LAT, LON, lats, lons)),
+            ('point-to-polyline distance', lambda: scalar_polyline(lats, lons), lambda: geo_util.get_min_polyline_distance(LAT, LON, lats, lons))
+        ]
+
+        for name, scalar, batch in cases:
+            t_scalar = run(scalar)
+
+            util.np = None
+            geo_util.np = None
+            t_python = run(batch)
+
+            util.np = np
+            geo_util.np = np
+            t_numpy = None
+
+            if np is not None:
+                min_size = util.NUMPY_MIN_SIZE
+                util.NUMPY_MIN_SIZE = 0
+                t_numpy = run(batch)
+                util.NUMPY_MIN_SIZE = min_size
+
+            best = t_python if t_numpy is None else min(t_python, t_numpy)
+            numpy_str = 'n/a' if t_numpy is None else f'{t_numpy:.1f}'
+            print(f'{count:>8} {name:<28} {t_scalar:>10.1f} {t_python:>10.1f} {numpy_str:>10} {t_scalar / best:>7.1f}x')
+
+    print('(times in microseconds per call)')
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]]
+
+    if len(sizes) == 0:
+        sizes = [4, 16, 64, 256, 4096]
+
+    main(sizes)
@@ -1,5 +1,7 @@
+from array import array
 import math
 import util
+from util import np
 
 FLOAT_INF = float('inf')
 
@@ -137,7 +139,7 @@ def get_min_distance(sp1, sp2, latu, lonu, seconds):
 
     h5 = FLOAT_INF
     if lon != FLOAT_INF:
-         h5 = util.haversine_distance(lon, lat, latu, lonu)   # distance of U from INTERSECTION_POINT
+         h5 = util.haversine_distance(lat, lon, latu, lonu)   # distance of U from INTERSECTION_POINT
 
     #print(f'- d3: {d3}')
     #print(f'- d4: {d4}')
@@ -148,3 +150,191 @@ def get_min_distance(sp1, sp2, latu, lonu, seconds):
         return min(h1, h2, h5)
     else:
         return min(h1, h2)
+
+"""
+Equirectangular projection of lat/long degrees into planar coordinates in feet,
+centered on `lat0`/`lon0`. Distances computed from projected coordinates are
+within a fraction of a percent of haversine distances for points within a few
+dozen miles of the center, which covers a typical agency service area.
+"""
+class Projection:
+    def __init__(self, lat0, lon0):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.ky = util.EARTH_RADIUS_IN_FEET * math.pi / 180
+        self.kx = self.ky * math.cos(math.radians(lat0))
+
+    # returns a projection centered on Area `area`
+    @staticmethod
+    def for_area(area):
+        center = area.get_center()
+        return Projection(center.lat, center.lon)
+
+    def get_xy(self, lat, lon):
+        return ((lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky)
+
+    # returns (xs, ys) arrays for lat/long arrays
+    def project(self, lats, lons):
+        if util.use_numpy(lats):
+            x = (np.asarray(lons, dtype=np.float64) - self.lon0) * self.kx
+            y = (np.asarray(lats, dtype=np.float64) - self.lat0) * self.ky
+            return (array('d', x.tobytes()), array('d', y.tobytes()))
+
+        x = array('d', [(lon - self.lon0) * self.kx for lon in lons])
+        y = array('d', [(lat - self.lat0) * self.ky for lat in lats])
+        return (x, y)
+
+    def __str__(self):
+        return f'{{lat0: {self.lat0}, lon0: {self.lon0}}}'
+
+def get_min_polyline_distance(latu, lonu, lats, lons):
+    """
+    Get the minimal distance of a GPS update U from the polyline through
+    the given points, i.e. the distance from U to the closest point on
+    any of the polyline's legs.
+
+    Distances are computed in a local equirectangular projection centered
+    on U, which is accurate to well under a foot at trip segment scale.
+
+    Args:
+        latu (float): fractional lat value of U
+        lonu (float): fractional long value of U
+        lats (list): lat values of polyline points
+        lons (list): long values of polyline points
+
+    Returns:
+        (distance, index) tuple with distance in feet and the index of the
+        polyline point closest to U's projection, (inf, -1) for no points.
+    """
+
+    xs, ys = Projection(latu, lonu).project(lats, lons)
+    return get_min_planar_distance(0, 0, xs, ys)
+
+def get_min_planar_distance(xu, yu, xs, ys):
+    """
+    Planar version of get_min_polyline_distance(), for U and polyline points
+    already projected into feet with the same Projection.
+
+    Args:
+        xu (float): x value of U
+        yu (float): y value of U
+        xs (list): x values of polyline points
+        ys (list): y values of polyline points
+
+    Returns:
+        (distance, index) tuple with distance in feet and the index of the
+        polyline point closest to U's projection, (inf, -1) for no points.
+    """
+
+    count = len(xs)
+
+    if count == 0:
+        return (FLOAT_INF, -1)
+
+    if count == 1:
+        x = xs[0] - xu
+        y = ys[0] - yu
+        return (math.sqrt(x * x + y * y), 0)
+
+    if util.use_numpy(xs):
+        x = np.asarray(xs, dtype=np.float64) - xu
+        y = np.asarray(ys, dtype=np.float64) - yu
+
+        x0 = x[:-1]
+        y0 = y[:-1]
+        dx = x[1:] - x0
+        dy = y[1:] - y0
+
+        l2 = dx * dx + dy * dy
+        t = np.divide(-(x0 * dx + y0 * dy), l2, out=np.zeros_like(l2), where=l2 > 0)
+        np.clip(t, 0, 1, out=t)
+
+        px = x0 + t * dx
+        py = y0 + t * dy
+        d2 = px * px + py * py
+
+        i = int(np.argmin(d2))
+        index = i if t[i] < .5 else i + 1
+
+        return (math.sqrt(d2[i]), index)
+
+    min_d2 = FLOAT_INF
+    index = -1
+    x0 = xs[0] - xu
+    y0 = ys[0] - yu
+
+    for i in range(count - 1):
+        x1 = xs[i + 1] - xu
+        y1 = ys[i + 1] - yu
+        dx = x1 - x0
+        dy = y1 - y0
+
+        l2 = dx * dx + dy * dy
+        t = 0
+
+        if l2 > 0:
+            t = min(max(-(x0 * dx + y0 * dy) / l2, 0), 1)
+
+        px = x0 + t * dx
+        py = y0 + t * dy
+        d2 = px * px + py * py
+
+        if d2 < min_d2:
+            min_d2 = d2
+            index = i if t < .5 else i + 1
+
+        x0 = x1
+        y0 = y1
+
+    return (math.sqrt(min_d2), index)
+
+def get_min_planar_distances(xu, yu, xs, ys, starts):
+    """
+    Batch version of get_min_planar_distance() for several polylines whose
+    points are stacked into the same arrays. Requires NumPy.
+
+    Args:
+        xu (float): x value of U
+        yu (float): y value of U
+        xs (ndarray): x values of all polyline points
+        ys (ndarray): y values of all polyline points
+        starts (ndarray): index of the first point of each polyline, ascending,
+            each polyline having at least one point
+
+    Returns:
+        (distances, indices) arrays with the distance in feet of U from each
+        polyline and the index of the polyline point closest to U's projection,
+        relative to the start of the polyline.
+    """
+
+    count = len(xs)
+    x = xs - xu
+    y = ys - yu
+
+    # the last point of each polyline gets a zero length leg to itself,
+    # so that legs never connect points of different polylines
+    ends = np.append(starts[1:], count) - 1
+    following = np.arange(1, count + 1)
+    following[ends] = ends
+
+    x0 = x
+    y0 = y
+    dx = x[following] - x0
+    dy = y[following] - y0
+
+    l2 = dx * dx + dy * dy
+    t = np.divide(-(x0 * dx + y0 * dy), l2, out=np.zeros_like(l2), where=l2 > 0)
+    np.clip(t, 0, 1, out=t)
+
+    px = x0 + t * dx
+    py = y0 + t * dy
+    d2 = px * px + py * py
+
+    # first leg of each polyline that attains the polyline's minimum
+    min_d2 = np.minimum.reduceat(d2, starts)
+    polyline = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, count)))
+    hits = np.flatnonzero(d2 == min_d2[polyline])
+    first = hits[np.concatenate(([True], polyline[hits[1:]] != polyline[hits[:-1]]))]
+
+    indices = first - starts + (t[first] >= .5)
+    return (np.sqrt(min_d2), indices)
@@ -0,0 +1,113 @@
+"""
+Reports the segments per cell distribution of the adaptive grid for a feed, for
+a range of maximum segments per cell, next to a uniform 15x15 grid like the one
+it replaced, e.g.:
+
+    python grid-report.py ~/tmp/gtfs-cache ~/tmp/gtfs-cache/gtfs.zip [<max-cell-segments>...]
+
+'per update' is the average number of segments in the cell of random positions
+along trip segments, i.e. what get_trip_id() has to look at before filtering.
+"""
+
+import inference
+import log
+import random
+import sys
+import time
+import util
+from grid import Grid
+
+SAMPLE_COUNT = 20000
+UNIFORM_SUBDIVISIONS = 15
+
+# segments go to all cells their bounding box overlaps, on a fixed n x n grid
+class UniformGrid:
+    def __init__(self, bounding_box, subdivisions):
+        self.bounding_box = bounding_box
+        self.subdivisions = subdivisions
+        self.table = {}
+
+    def get_cell(self, lat, lon):
+        bb = self.bounding_box
+        row = int((bb.top_left.lat - lat) / (bb.top_left.lat - bb.bottom_right.lat) * self.subdivisions)
+        column = int((lon - bb.top_left.lon) / (bb.bottom_right.lon - bb.top_left.lon) * self.subdivisions)
+        return (min(max(row, 0), self.subdivisions - 1), min(max(column, 0), self.subdivisions - 1))
+
+    def add_segment(self, segment):
+        r1, c1 = self.get_cell(segment.bounding_box.top_left.lat, segment.bounding_box.top_left.lon)
+        r2, c2 = self.get_cell(segment.bounding_box.bottom_right.lat, segment.bounding_box.bottom_right.lon)
+
+        for r in range(r1, r2 + 1):
+            for c in range(c1, c2 + 1):
+                self.table.setdefault(r * self.subdivisions + c, []).append(segment)
+
+    def get_index(self, lat, lon):
+        if not self.bounding_box.contains(lat, lon):
+            return -1
+        r, c = self.get_cell(lat, lon)
+        return r * self.subdivisions + c
+
+    def get_stats(self):
+        counts = sorted(len(self.table[i]) for i in self.table)
+        return {
+            'cells': self.subdivisions * self.subdivisions,
+            'empty_cells': self.subdivisions * self.subdivisions - len(counts),
+            'max_depth': 0,
+            'segment_refs': sum(counts),
+            'median': counts[len(counts) // 2],
+            'p90': counts[int(len(counts) * .9)],
+            'max': counts[-1]
+        }
+
+def get_per_update(grid, samples):
+    total = 0
+    start = time.perf_counter()
+
+    for p in samples:
+        index = grid.get_index(p.lat, p.lon)
+        total += len(grid.table.get(index, []))
+
+    elapsed = time.perf_counter() - start
+    return total / len(samples), elapsed / len(samples) * 1000000
+
+def report(name, grid, samples):
+    stats = grid.get_stats()
+    per_update, lookup_us = get_per_update(grid, samples)
+    print(f'{name:<16} {stats["cells"]:>6} {stats["empty_cells"]:>6} {stats["max_depth"]:>6} {stats["segment_refs"]:>8} {stats["median"]:>7} {stats["p90"]:>6} {stats["max"]:>6} {per_update:>11.1f} {lookup_us:>10.2f}')
+
+def main(cache_folder, url, sizes):
+    inf = inference.TripInference(cache_folder, url, 'test-agency-id', 'test-vehicle-id')
+    segments = [s for shape_id in inf.shape_segments for s in inf.shape_segments[shape_id]]
+    samples = [util.get_random_point(random.choice(segments).bounding_box) for i in range(SAMPLE_COUNT)]
+
+    print(f'- segments: {len(segments)}')
+    print(f'- area: {inf.area}')
+    print(f'{"grid":<16} {"cells":>6} {"empty":>6} {"depth":>6} {"refs":>8} {"median":>7} {"p90":>6} {"max":>6} {"per update":>11} {"lookup us":>10}')
+
+    uniform = UniformGrid(inf.area, UNIFORM_SUBDIVISIONS)
+    for s in segments:
+        uniform.add_segment(s)
+    report(f'uniform {UNIFORM_SUBDIVISIONS}x{UNIFORM_SUBDIVISIONS}', uniform, samples)
+
+    for size in sizes:
+        grid = Grid(inf.area, size)
+        for s in segments:
+            grid.add_segment(s, 0)
+        report(f'adaptive {size}', grid, samples)
+
+    report('model grid', inf.grid, samples)
+    print('(median, p90 and max are segments per non-empty cell)')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'usage: {sys.argv[0]} <cache-folder> <static-gtfs-url> [<max-cell-segments>...]')
+        exit(1)
+
+    sizes = [int(a) for a in sys.argv[3:]]
+    if len(sizes) == 0:
+        sizes = [32, 64, 128, 256]
+
+    log.set_level(log.WARNING)
+    log.set_result_sink(log.plain_sink, [])
+
+    main(sys.argv[1], sys.argv[2], sizes)
@@ -1,14 +1,67 @@
+import log
 import util
 
+DEFAULT_MAX_CELL_SEGMENTS = 64
+DEFAULT_MIN_CELL_SIZE = 1000 # feet
+
+logger = log.get_logger('grid')
+
+"""
+Adaptive spatial index over trip segments. Starts out as a single cell covering
+`bounding_box` and splits a cell into quadrants once it holds more than
+`max_cell_segments` segments, unless that would make the cell smaller than
+`min_cell_size` feet on either side (e.g. at a transit center that most routes
+run through). A dense downtown thus ends up with small cells while outlying
+areas stay coarse.
+
+Cells are identified by integer indices. Only leaf cells hold segments and show
+up in self.table. Segments are added to the cells their way points fall into, and
+move to the quadrants their bounding box overlaps when a cell splits.
+"""
 class Grid:
-    def __init__(self, bounding_box, subdivisions):
-        aspect_ratio = bounding_box.get_aspect_ratio()
-        util.debug(f'grid: top_left={bounding_box.top_left} bottom_right={bounding_box.bottom_right} subdivisions={subdivisions}')
+    def __init__(self, bounding_box, max_cell_segments = DEFAULT_MAX_CELL_SEGMENTS, min_cell_size = DEFAULT_MIN_CELL_SIZE):
+        logger.debug('grid: top_left=%s bottom_right=%s max_cell_segments=%s', bounding_box.top_left, bounding_box.bottom_right, max_cell_segments)
         self.bounding_box = bounding_box
-        self.subdivisions = subdivisions
+        self.max_cell_segments = max_cell_segments
+        self.min_lat_delta = util.get_feet_as_lat_degrees(min_cell_size)
+        self.min_lon_delta = util.get_feet_as_long_degrees(min_cell_size)
         self.table = {}
 
+        # per cell bounds, split point and index of the first of 4 child cells, -1 for leaves
+        self.min_lat = []
+        self.max_lat = []
+        self.min_lon = []
+        self.max_lon = []
+        self.mid_lat = []
+        self.mid_lon = []
+        self.children = []
+        self.depth = []
+
+        self.add_cell(bounding_box.bottom_right.lat, bounding_box.top_left.lat, bounding_box.top_left.lon, bounding_box.bottom_right.lon, 0)
+
+    def add_cell(self, min_lat, max_lat, min_lon, max_lon, depth):
+        self.min_lat.append(min_lat)
+        self.max_lat.append(max_lat)
+        self.min_lon.append(min_lon)
+        self.max_lon.append(max_lon)
+        self.mid_lat.append((min_lat + max_lat) / 2)
+        self.mid_lon.append((min_lon + max_lon) / 2)
+        self.children.append(-1)
+        self.depth.append(depth)
+
+        return len(self.children) - 1
+
+    # adds `segment` to cell `index`. If the cell was split since `index` was
+    # looked up, the segment goes to the leaves below it that it overlaps
     def add_segment(self, segment, index):
+        if index < 0:
+            return
+
+        if self.children[index] >= 0:
+            for i in self.get_overlapping_leaves(segment.get_bounds(), index):
+                self.add_segment(segment, i)
+            return
+
         if index in self.table:
             list = self.table[index]
         else:
@@ -17,16 +70,65 @@ class Grid:
 
         list.append(segment)
 
+        if len(list) > self.max_cell_segments and self.can_split(index):
+            self.split(index)
+
+    def can_split(self, index):
+        return (self.max_lat[index] - self.min_lat[index] >= 2 * self.min_lat_delta
+            and self.max_lon[index] - self.min_lon[index] >= 2 * self.min_lon_delta)
+
+    def split(self, index):
+        mid_lat = self.mid_lat[index]
+        mid_lon = self.mid_lon[index]
+        depth = self.depth[index] + 1
+
+        # child order matches the offset computed in get_index()
+        first = self.add_cell(self.min_lat[index], mid_lat, self.min_lon[index], mid_lon, depth)
+        self.add_cell(self.min_lat[index], mid_lat, mid_lon, self.max_lon[index], depth)
+        self.add_cell(mid_lat, self.max_lat[index], self.min_lon[index], mid_lon, depth)
+        self.add_cell(mid_lat, self.max_lat[index], mid_lon, self.max_lon[index], depth)
+        self.children[index] = first
+
+        for segment in self.table.pop(index):
+            self.add_segment(segment, index)
+
+    # `bounds` is (min_lat, max_lat, min_lon, max_lon)
+    def get_overlapping_leaves(self, bounds, index):
+        first = self.children[index]
+
+        if first < 0:
+            return [index]
+
+        min_lat, max_lat, min_lon, max_lon = bounds
+        result = []
+
+        for i in range(first, first + 4):
+            if (min_lat <= self.max_lat[i] and max_lat >= self.min_lat[i]
+                and min_lon <= self.max_lon[i] and max_lon >= self.min_lon[i]):
+                result += self.get_overlapping_leaves(bounds, i)
+
+        return result
+
+    # returns the index of the leaf cell containing lat/lon, -1 if outside the grid
     def get_index(self, lat, lon):
-        ### lat == y, lon == x?
-        latfrac = self.bounding_box.get_lat_fraction(lat, False)
-        if latfrac is None:
-            return -1
-        lonfrac = self.bounding_box.get_long_fraction(lon, False)
-        if lonfrac is None:
+        if (lat < self.min_lat[0] or lat > self.max_lat[0]
+            or lon < self.min_lon[0] or lon > self.max_lon[0]):
             return -1
-        index = (self.subdivisions * int(round(self.subdivisions * latfrac))
-            + int(round(self.subdivisions * lonfrac)))
+
+        index = 0
+        children = self.children
+        mid_lat = self.mid_lat
+        mid_lon = self.mid_lon
+        first = children[0]
+
+        while first >= 0:
+            if lat >= mid_lat[index]:
+                first += 2
+            if lon >= mid_lon[index]:
+                first += 1
+            index = first
+            first = children[index]
+
         return index
 
     def get_segment_list(self, lat, lon):
@@ -37,5 +139,26 @@ class Grid:
         else:
             return None
 
+    # returns segments per cell distribution and tree shape
+    def get_stats(self):
+        counts = sorted(len(self.table[i]) for i in self.table)
+        leaves = [i for i in range(len(self.children)) if self.children[i] < 0]
+
+        stats = {
+            'cells': len(leaves),
+            'empty_cells': len(leaves) - len(counts),
+            'max_depth': max(self.depth),
+            'segment_refs': sum(counts)
+        }
+
+        if len(counts) > 0:
+            stats['min'] = counts[0]
+            stats['median'] = counts[len(counts) // 2]
+            stats['mean'] = round(sum(counts) / len(counts), 1)
+            stats['p90'] = counts[int(len(counts) * .9)]
+            stats['max'] = counts[-1]
+
+        return stats
+
     def __str__(self):
-        return '{\n  bounding_box: ' + str(self.bounding_box) + '\n  subdivisions: ' + str(self.subdivisions) + '\n  len(table): ' + str(len(self.table)) + '\n}'
+        return '{\n  bounding_box: ' + str(self.bounding_box) + '\n  max_cell_segments: ' + str(self.max_cell_segments) + '\n  stats: ' + str(self.get_stats()) + '\n}'
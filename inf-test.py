@@ -1,4 +1,5 @@
 import inference
+import random
 import sys
 import time
 import util
@@ -9,7 +10,7 @@ def main(args):
     #area = Area(ShapePoint(34.902, -120.45993), ShapePoint(34.41789, -119.6852))
 
     start = util.get_current_time_millis()
-    inf = inference.TripInference(args[0], args[1], 'test-agency-id', 'test-vehicle-id', 15)
+    inf = inference.TripInference(args[0], args[1], 'test-agency-id', 'test-vehicle-id')
     print(f'- inference.TripInference.VERSION: {inference.TripInference.VERSION}')
     elapsed = util.get_current_time_millis() - start
 
@@ -24,9 +25,11 @@ def main(args):
         for segment in segment_list:
             #print(f'-- segment.id: {segment.id}')
             p = util.get_random_point(segment.bounding_box)
-            seconds = util.get_random_int(segment.start_time, segment.end_time)
-            score = segment.get_score(p.lat, p.lon, seconds, args[0])
-            print(f'-- segment.id: {segment.id}, score: {score}')
+            trip = random.choice(segment.trips)
+            start_time, end_time = segment.get_times(trip)
+            seconds = util.get_random_int(start_time, end_time)
+            score = segment.get_score(trip, p.lat, p.lon, seconds, args[0])
+            print(f'-- segment.id: {segment.id}, trip.id: {trip.id}, score: {score}')
 
 
             trip_id = inf.get_trip_id(p.lat, p.lon, seconds)
@@ -1,270 +1,390 @@
+from array import array
+from bisect import bisect_left, bisect_right
 import copy
-import csv
 import datetime
 import json
 import math
-import os
+import sys
 import time
+import geo_util
+import log
 import util
 import platform
-from shapepoint import ShapePoint
 from area import Area
-from grid import Grid
-from segment import Segment
+from grid import Grid, DEFAULT_MAX_CELL_SEGMENTS
+from scoreboard import Scoreboard
+from segment import Segment, SegmentBatch, get_scores, MAX_TIME_DISTANCE
+from service_calendar import ServiceCalendar
+from shapestore import ShapeStore, NO_VALUE, NO_TIME
+from stopindex import StopIndex
 from timer import Timer
+from trip import Trip, TimePattern
 
-STOP_PROXIMITY = 150
+STOP_PROXIMITY = 150 # feet
 SCORE_THRESHOLD = 7
-MIN_FLUSH_TIME_DELTA = 30 * 60
+DELAY_TOLERANCE = 30 # seconds
 STOP_CAP = 10
+SNAPSHOT_VERSION = 8
+SNAPSHOT_PREFIX = 'ti-snapshot-'
+MAX_SNAPSHOTS = 8
+
+logger = log.get_logger('inference')
+
+# columns read from GTFS tables, everything else is projected away at parse time
+TRIP_COLUMNS = ['trip_id', 'route_id', 'service_id', 'shape_id', 'block_id']
+SHAPE_COLUMNS = ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_dist_traveled']
+STOP_COLUMNS = ['stop_id', 'stop_lat', 'stop_lon']
+ROUTE_COLUMNS = ['route_id', 'route_short_name', 'route_long_name']
+STOP_TIME_COLUMNS = ['trip_id', 'arrival_time', 'stop_id', 'stop_sequence', 'shape_dist_traveled']
+CALENDAR_DATE_COLUMNS = ['service_id', 'date', 'exception_type']
 
 class TripInference:
     VERSION = '0.2 (12/07/21)'
 
-    def __init__(self, path, url, agency_id, vehicle_id, subdivisions, dow = -1, epoch_seconds = -1):
+    def __init__(self, path, url, agency_id, vehicle_id, max_cell_segments = DEFAULT_MAX_CELL_SEGMENTS, delay_tolerance = DELAY_TOLERANCE):
         if path[-1] != '/':
             path += '/'
 
-        util.update_cache_if_needed(path, url)
+        if util.update_cache_if_needed(path, url):
+            self.remove_snapshots(path)
+            Segment.waypoint_cache.close()
 
-        self.trip_candidates = {}
-        self.last_candidate_flush = time.time()
+        self.scoreboard = Scoreboard()
         self.agency_id = agency_id
         self.vehicle_id = vehicle_id
+        self.delay_tolerance = delay_tolerance
+        self.published_delays = {}
+        self.arrival_times = {}
 
         self.path = path
-        calendar_map = self.get_calendar_map()
-        util.debug(f'- calendar_map: {json.dumps(calendar_map, indent = 4)}')
+        self.segment_batches = {}
+        self.staged_trip_id = None
+        self.staged_for_trip_id = None
 
-        route_map = self.get_route_map()
-        util.debug(f'- route_map: {json.dumps(route_map, indent = 4)}')
+        snapshot_path = self.get_snapshot_path(max_cell_segments)
+        logger.debug('- snapshot_path: %s', snapshot_path)
 
-        self.area = Area()
-        self.populateBoundingBox(self.area)
-        util.debug(f'- self.area: {self.area}')
-        self.grid = Grid(self.area, subdivisions)
+        if not self.load_snapshot(snapshot_path):
+            self.build(max_cell_segments)
+            self.save_snapshot(snapshot_path)
+
+        self.index_trips()
+
+    """
+    Derives lookups from the grid and block map: self.trips maps trip IDs to trips,
+    self.shape_segments maps shape IDs to their segments in shape order and
+    self.trip_blocks maps trip IDs to block IDs. Trip lists in self.block_map get
+    sorted by start time.
+    """
+    def index_trips(self):
+        segment_map = {}
+
+        for index in self.grid.table:
+            for segment in self.grid.table[index]:
+                shape_map = segment_map.get(segment.shape_id, None)
+
+                if shape_map is None:
+                    shape_map = {}
+                    segment_map[segment.shape_id] = shape_map
+
+                shape_map[segment.id] = segment
+
+        self.trips = {}
+        self.shape_segments = {}
+
+        for shape_id in segment_map:
+            segment_list = list(segment_map[shape_id].values())
+            segment_list.sort(key = lambda s: s.segment_index)
+            self.shape_segments[shape_id] = segment_list
+
+            for trip in segment_list[0].trips:
+                self.trips[trip.id] = trip
+
+        self.trip_blocks = {}
+
+        for block_id in self.block_map:
+            trip_list = self.block_map[block_id]
+            trip_list.sort(key = lambda t: t['start_time'])
+
+            for t in trip_list:
+                self.trip_blocks[t['trip_id']] = block_id
 
-        if dow < 0:
-            dow = datetime.datetime.today().weekday()
-        util.debug(f'- dow: {dow}')
+        logger.debug('- len(self.trips): %s', len(self.trips))
+        logger.debug('- len(self.shape_segments): %s', len(self.shape_segments))
+        logger.debug('- len(self.trip_blocks): %s', len(self.trip_blocks))
 
-        if epoch_seconds < 0:
-            epoch_seconds = util.get_epoch_seconds()
-        util.debug(f'+ epoch_seconds: {datetime.datetime.fromtimestamp(epoch_seconds)}')
+    """
+    Builds segments for all trips of all services in the feed. Which trips
+    are eligible on a given date is decided at scoring time, based on
+    self.calendar.
+    """
+    def build(self, max_cell_segments):
+        self.calendar = self.get_service_calendar()
+        logger.debug('- self.calendar: %s', self.calendar)
+
+        route_map = self.get_route_map()
+        if logger.is_enabled(log.DEBUG):
+            logger.debug('- route_map: %s', json.dumps(route_map, indent=4))
 
         self.stops = self.get_stops()
+        self.stop_index = StopIndex(self.stops)
         #util.debug(f'-- stops: {stops}')
 
         self.preload_stop_times()
-        self.preload_shapes()
 
-        self.compute_shape_lengths()
+        self.area = Area()
+        self.preload_shapes(self.area)
+        logger.debug('- self.area: %s', self.area)
+        self.grid = Grid(self.area, max_cell_segments)
+        self.projection = geo_util.Projection.for_area(self.area)
+        logger.debug('- self.projection: %s', self.projection)
+
         self.block_map = {}
+        self.shape_segments = {}
+        self.time_patterns = {}
 
         trip_set = set()
 
-        with platform.get_text_file_contents(path + '/trips.txt') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            count = 1
-
-            load_timer = Timer('load')
-
-            for r in rows:
-                loop_timer = Timer('loop')
-                trip_id = r['trip_id']
-                service_id = r['service_id']
-                shape_id = r['shape_id']
-
-                trip_set.add(trip_id)
-
-                if not service_id in calendar_map:
-                    util.debug(f'* service id \'{service_id}\' not found in calendar map, skipping trip \'{trip_id}\'')
-                    continue
-
-                cal = calendar_map[service_id].get('cal', None)
-                if cal is not None and cal[dow] != 1:
-                    util.debug(f'* dow \'{dow}\' not set, skipping trip \'{trip_id}\'')
-                    continue
-
-                start_date = calendar_map[service_id].get('start_date', None)
-                end_date = calendar_map[service_id].get('end_date', None)
-
-                if start_date is not None and end_date is not None:
-                    start_seconds = util.get_epoch_seconds(start_date)
-                    end_seconds = util.get_epoch_seconds(end_date)
-                    if epoch_seconds < start_seconds or epoch_seconds > end_seconds:
-                        util.debug(f'* trip date outside service period (start: {start_date}, end: {end_date}), skipping trip \'{trip_id}\'')
-                        continue
-
-                util.debug(f'')
-                util.debug(f'-- trip_id: {trip_id} ({count}/{len(rows)})')
-                count += 1
-
-                route_id = r['route_id']
-                shape_id = r['shape_id']
-                #util.debug(f'-- shape_id: {shape_id}')
-                timer = Timer('way points')
-                way_points = self.get_shape_points(shape_id)
-                #util.debug(timer)
-                #util.debug(f'-- way_points: {way_points}')
-                util.debug(f'-- len(way_points): {len(way_points)}')
-
-                if len(way_points) == 0:
-                    util.debug(f'* no way points for trip_id \'{trip_id}\', shape_id \'{shape_id}\'')
-                    continue
-
-                timer = Timer('stop times')
-                stop_times = self.get_stop_times(trip_id)
-
-                block_id = r.get('block_id', None)
-                #util.debug(f'-- block_id: {block_id}')
-
-                if block_id is not None and len(block_id) > 0 and stop_times is not None and len(stop_times) > 0:
-                    trip_list = self.block_map.get(block_id, None)
-
-                    if trip_list is None:
-                        trip_list = []
-                        self.block_map[block_id] = trip_list
-
-                    start_time = stop_times[0].get('arrival_time', None)
-                    end_time = stop_times[-1].get('arrival_time', None)
-
-                    if start_time is not None and end_time is not None:
-                        trip_list.append({
-                            'trip_id': trip_id,
-                            'start_time': start_time,
-                            'end_time': end_time
-                        })
-
-                #util.debug(timer)
-                #util.debug(f'-- stop_times: {stop_times}')
-                util.debug(f'-- len(stop_times): {len(stop_times)}')
-                timer = Timer('interpolate')
-                self.interpolate_way_point_times(way_points, stop_times, self.stops)
-                #util.debug(timer)
-
-                #trip_name = route_map[route_id]['name'] + ' @ ' + util.seconds_to_ampm_hhmm(stop_times[0]['arrival_time'])
-                trip_name = trip_id + ' @ ' + util.seconds_to_ampm_hhmm(stop_times[0]['arrival_time'])
-                util.debug(f'-- trip_name: {trip_name}')
-                shape_length = self.shape_length_map[shape_id]
-
-                if shape_length is None:
-                    segment_length = 2 * util.FEET_PER_MILE
-                else:
-                    segment_length = int(shape_length / 30)
-
-                #util.debug(f'-- segment_length: {segment_length}')
-                timer = Timer('segments')
-                self.make_trip_segments(trip_id, trip_name, stop_times[0], way_points, segment_length)
-                #util.debug(timer)
-                #util.debug(loop_timer)
-
-        util.debug(f'-- self.block_map: {json.dumps(self.block_map, indent = 4)}')
-
-        util.debug(load_timer)
-        util.debug(f'-- self.grid: {self.grid}')
-
-        for tid in self.stop_time_map:
-            if not tid in trip_set:
-                self.stop_time_map.pop(tid)
+        rows = list(self.read_table('trips.txt', TRIP_COLUMNS))
+        count = 1
 
-        self.shape_map = {}
+        load_timer = Timer('load')
 
-    def populateBoundingBox(self, area):
-        with platform.get_text_file_contents(self.path + '/shapes.txt') as f:
-            names = f.readline().strip()
-            #util.debug(f'-- names: {names}')
-            csvline = csv.CSVLine(names)
+        for r in rows:
+            trip_id = r['trip_id']
+            service_id = r['service_id']
+            shape_id = r['shape_id']
 
-            while True:
-                line = f.readline()
+            trip_set.add(trip_id)
 
-                if not line:
-                    break
+            if not service_id in self.calendar:
+                logger.debug("* service id '%s' not found in calendar, skipping trip '%s'", service_id, trip_id)
+                continue
 
-                line = line.strip()
-                r = csvline.parse(line)
+            logger.debug('')
+            logger.debug('-- trip_id: %s (%s/%s)', trip_id, count, len(rows))
+            count += 1
 
-                lat = float(r['shape_pt_lat'])
-                lon = float(r['shape_pt_lon'])
-                area.update(lat, lon)
+            #util.debug(f'-- shape_id: {shape_id}')
+            way_points = self.get_shape_points(shape_id)
+            #util.debug(f'-- way_points: {way_points}')
 
-    def compute_shape_lengths(self):
-        self.shape_length_map = {}
+            if way_points is None or len(way_points) == 0:
+                logger.debug("* no way points for trip_id '%s', shape_id '%s'", trip_id, shape_id)
+                continue
 
-        for shape_id in self.shape_map:
-            #util.debug(f'-- shape_id: {shape_id}')
-            point_list = self.shape_map[shape_id]
-            #util.debug(f'-- point_list: {point_list}')
-            length = 0
+            logger.debug('-- len(way_points): %s', len(way_points))
 
-            for i in range(len(point_list) - 1):
-                p1 = point_list[i];
-                #util.debug(f'--- p1: {p1}')
-                p2 = point_list[i + 1]
-                #util.debug(f'--- p2: {p2}')
+            stop_times = self.get_stop_times(trip_id)
 
-                length += util.haversine_distance(p1['lat'], p1['long'], p2['lat'], p2['long'])
+            block_id = r.get('block_id', None)
+            #util.debug(f'-- block_id: {block_id}')
 
-            self.shape_length_map[shape_id] = length
-            util.debug(f'++ length for shape {shape_id}: {util.get_display_distance(length)}')
+            if block_id is not None and len(block_id) > 0 and stop_times is not None and len(stop_times) > 0:
+                trip_list = self.block_map.get(block_id, None)
 
-    def preload_shapes(self):
-        self.shape_map = {}
+                if trip_list is None:
+                    trip_list = []
+                    self.block_map[block_id] = trip_list
 
-        with platform.get_text_file_contents(self.path + '/shapes.txt') as f:
-            names = f.readline().strip()
-            #util.debug(f'-- names: {names}')
-            csvline = csv.CSVLine(names)
+                start_time = stop_times[0].get('arrival_time', None)
+                end_time = stop_times[-1].get('arrival_time', None)
 
-            while True:
-                file_offset = f.tell()
-                #util.debug(f'-- file_offset: {file_offset}')
-                line = f.readline()
+                if start_time is not None and end_time is not None:
+                    trip_list.append({
+                        'trip_id': trip_id,
+                        'service_id': service_id,
+                        'start_time': start_time,
+                        'end_time': end_time
+                    })
 
-                if not line:
-                    break
+            #util.debug(f'-- stop_times: {stop_times}')
+            logger.debug('-- len(stop_times): %s', len(stop_times))
+            self.interpolate_way_point_times(way_points, stop_times, self.stops)
 
-                line = line.strip()
-                r = csvline.parse(line)
-                shape_id = r['shape_id']
-                #debug.log(f'-- sid: {sid}')
+            #trip_name = route_map[route_id]['name'] + ' @ ' + util.seconds_to_ampm_hhmm(stop_times[0]['arrival_time'])
+            trip_name = trip_id + ' @ ' + util.seconds_to_ampm_hhmm(stop_times[0]['arrival_time'])
+            logger.debug('-- trip_name: %s', trip_name)
+            shape_length = self.shape_length_map[shape_id]
 
-                lat = float(r['shape_pt_lat'])
-                lon = float(r['shape_pt_lon'])
+            if shape_length is None:
+                segment_length = 2 * util.FEET_PER_MILE
+            else:
+                segment_length = int(shape_length / 30)
+
+            #util.debug(f'-- segment_length: {segment_length}')
+            segment_list = self.shape_segments.get(shape_id, None)
+
+            if segment_list is None:
+                segment_list = self.make_shape_segments(shape_id, way_points, segment_length)
+                self.shape_segments[shape_id] = segment_list
 
-                plist = self.shape_map.get(shape_id, None)
+            self.add_trip(trip_id, trip_name, service_id, stop_times[0], way_points, segment_list)
 
-                if plist is None:
-                    plist = []
-                    self.shape_map[shape_id] = plist
+        for shape_id in self.shape_segments:
+            for segment in self.shape_segments[shape_id]:
+                segment.index_trips()
 
-                entry = {'lat': lat, 'long': lon, 'file_offset': file_offset}
-                sdt = r.get('shape_dist_traveled', None)
+        if logger.is_enabled(log.DEBUG):
+            logger.debug('-- self.block_map: %s', json.dumps(self.block_map, indent=4))
 
-                if sdt is not None and len(sdt) > 0:
-                    entry['traveled'] = float(sdt)
+        logger.debug('%s', load_timer)
+        logger.debug('-- self.grid: %s', self.grid)
+        logger.debug('-- time patterns: %s', len(self.time_patterns))
 
-                plist.append(entry)
+        for tid in list(self.stop_time_map):
+            if not tid in trip_set:
+                self.stop_time_map.pop(tid)
+
+        self.shape_store = None
+        self.time_patterns = None
+
+    """
+    A snapshot holds everything build() derives from the static GTFS feed, so that
+    later starts for the same feed and grid size can skip the (potentially minutes
+    long) rebuild. Since the model covers all service dates, snapshot file names are
+    keyed by feed hash and maximum segments per grid cell only. SNAPSHOT_VERSION needs to be bumped
+    whenever the layout of the persisted state changes.
+    """
+    def get_snapshot_path(self, max_cell_segments):
+        feed_hash = util.get_feed_hash(self.path)
+        return f'{self.path}{SNAPSHOT_PREFIX}{feed_hash[:16]}-{max_cell_segments}.pickle'
+
+    def load_snapshot(self, snapshot_path):
+        if not platform.resource_exists(snapshot_path):
+            logger.debug('* no snapshot found, building from scratch')
+            return False
+
+        timer = Timer('snapshot load')
+
+        try:
+            snapshot = platform.read_object(snapshot_path)
+        except:
+            util.error(f'failed to read snapshot {snapshot_path}: {sys.exc_info()[0]}')
+            return False
+
+        if snapshot.get('version', None) != SNAPSHOT_VERSION:
+            logger.debug('* snapshot version mismatch, building from scratch')
+            return False
+
+        self.area = snapshot['area']
+        self.grid = snapshot['grid']
+        self.projection = geo_util.Projection.for_area(self.area)
+        self.calendar = snapshot['calendar']
+        self.stops = snapshot['stops']
+        self.stop_index = StopIndex(self.stops)
+        self.stop_time_map = snapshot['stop_time_map']
+        self.block_map = snapshot['block_map']
+        self.shape_store = None
+
+        # keep segment IDs unique across loaded and newly created segments
+        Segment.id_base = max(Segment.id_base, snapshot['segment_id_base'])
+
+        logger.debug('%s', timer)
+        logger.debug('-- self.grid: %s', self.grid)
+        return True
+
+    def save_snapshot(self, snapshot_path):
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'area': self.area,
+            'grid': self.grid,
+            'calendar': self.calendar,
+            'stops': self.stops,
+            'stop_time_map': self.stop_time_map,
+            'block_map': self.block_map,
+            'segment_id_base': Segment.id_base
+        }
+
+        try:
+            platform.write_object(snapshot_path, snapshot)
+        except:
+            util.error(f'failed to write snapshot {snapshot_path}: {sys.exc_info()[0]}')
+            return
+
+        # keep only the most recently written snapshots around
+        names = platform.list_resources(self.path, SNAPSHOT_PREFIX)
+        names.sort(key = lambda n: platform.get_mtime(self.path + n), reverse = True)
+
+        for n in names[MAX_SNAPSHOTS:]:
+            platform.remove_resource(self.path + n)
+
+    def remove_snapshots(self, path):
+        for n in platform.list_resources(path, SNAPSHOT_PREFIX):
+            logger.debug('- removing stale snapshot %s', n)
+            platform.remove_resource(path + n)
+
+    def read_table(self, name, columns = None, with_offsets = False):
+        return platform.read_zip_table(self.path + 'gtfs.zip', name, with_offsets, columns)
+
+    """
+    Reads shapes.txt in a single pass. Populates `area` with the bounding box of all shape points,
+    self.shape_store with the points of each shape and self.shape_length_map with the length of
+    each shape in feet. Each point carries its byte offset in shapes.txt and its cumulative
+    distance in feet from the start of the shape.
+    """
+    def preload_shapes(self, area):
+        self.shape_store = ShapeStore()
+        self.shape_length_map = {}
+        last_shape_id = None
+        shape = None
+
+        min_lat = min_lon = float('inf')
+        max_lat = max_lon = float('-inf')
+
+        for file_offset, r in self.read_table('shapes.txt', SHAPE_COLUMNS, True):
+            #util.debug(f'-- file_offset: {file_offset}')
+            shape_id = r['shape_id']
+            #debug.log(f'-- sid: {sid}')
+
+            lat = float(r['shape_pt_lat'])
+            lon = float(r['shape_pt_lon'])
+
+            if lat < min_lat:
+                min_lat = lat
+            if lat > max_lat:
+                max_lat = lat
+            if lon < min_lon:
+                min_lon = lon
+            if lon > max_lon:
+                max_lon = lon
+
+            if shape_id != last_shape_id:
+                shape = self.shape_store.get_or_create_shape(shape_id)
+                last_shape_id = shape_id
+
+            traveled = NO_VALUE
+            sdt = r.get('shape_dist_traveled', None)
+
+            if sdt is not None and len(sdt) > 0:
+                traveled = float(sdt)
+
+            shape.append(lat, lon, file_offset, 0, traveled)
+
+        if len(self.shape_store) > 0:
+            area.update(max_lat, min_lon)
+            area.update(min_lat, max_lon)
+
+        for shape_id in self.shape_store:
+            shape = self.shape_store.get_shape(shape_id)
+            shape.update_distances()
+            length = shape.get_length()
+            self.shape_length_map[shape_id] = length
+            logger.debug('++ length for shape %s: %s', shape_id, util.get_display_distance(length))
 
     def get_shape_points(self, shape_id):
-        return self.shape_map.get(shape_id, None)
+        return self.shape_store.get_shape(shape_id)
 
     def get_stops(self):
         slist = {}
 
-        with platform.get_text_file_contents(self.path + '/stops.txt') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
+        for r in self.read_table('stops.txt', STOP_COLUMNS):
+            # util.debug(f'-- r: {r}')
+            id = r['stop_id']
+            lat = float(r['stop_lat'])
+            lon = float(r['stop_lon'])
 
-            for r in rows:
-                # util.debug(f'-- r: {r}')
-                id = r['stop_id']
-                lat = float(r['stop_lat'])
-                lon = float(r['stop_lon'])
-
-                slist[id] = {'lat': lat, 'long': lon}
+            slist[id] = {'lat': lat, 'long': lon}
 
         return slist
 
@@ -272,83 +392,67 @@ class TripInference:
         #util.debug(f'get_route_map()')
         route_map = {}
 
-        with platform.get_text_file_contents(self.path + '/routes.txt') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-
-            for r in rows:
-                route_id = r['route_id']
-                #debug.log(f'-- route_id id: {route_id}')
-                short_name = r['route_short_name'] ### TODO short_name is optional
-                long_name = r['route_long_name']
-                name = short_name if len(short_name) > 0 else long_name
+        for r in self.read_table('routes.txt', ROUTE_COLUMNS):
+            route_id = r['route_id']
+            #debug.log(f'-- route_id id: {route_id}')
+            short_name = r['route_short_name'] ### TODO short_name is optional
+            long_name = r['route_long_name']
+            name = short_name if len(short_name) > 0 else long_name
 
-                route_map[route_id] = {'name': name}
+            route_map[route_id] = {'name': name}
 
         return route_map
 
-    def get_calendar_map(self):
-        #util.debug(f'get_calendar_map()')
-        calendar_map = {}
+    # calendar.txt and calendar_dates.txt are both optional, as long as one of them is present
+    def get_service_calendar(self):
+        calendar_rows = []
+        calendar_date_rows = []
+        zip_path = self.path + 'gtfs.zip'
 
-        with platform.get_text_file_contents(self.path + '/calendar.txt') as f:
-            dow = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-            reader = csv.DictReader(f)
-            rows = list(reader)
+        if platform.zip_entry_exists(zip_path, 'calendar.txt'):
+            calendar_rows = self.read_table('calendar.txt')
 
-            for r in rows:
-                service_id = r['service_id']
-                util.debug(f'-- service id: {service_id}')
-                cal = []
+        if platform.zip_entry_exists(zip_path, 'calendar_dates.txt'):
+            calendar_date_rows = self.read_table('calendar_dates.txt', CALENDAR_DATE_COLUMNS)
 
-                for d in dow:
-                    cal.append(int(r[d]))
-                #util.debug(f'-- cal: {cal}')
-
-                calendar_map[service_id] = {'cal': cal, 'start_date': r.get('start_date', None), 'end_date': r.get('end_date', None)}
-
-        return calendar_map
+        return ServiceCalendar(calendar_rows, calendar_date_rows)
 
     def preload_stop_times(self):
         self.stop_time_map = {}
 
-        with platform.get_text_file_contents(self.path + '/stop_times.txt') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
+        for r in self.read_table('stop_times.txt', STOP_TIME_COLUMNS):
+            trip_id = r['trip_id']
 
-            for r in rows:
-                trip_id = r['trip_id']
+            arrival_time = r['arrival_time']
+            if len(arrival_time) == 0:
+                continue
 
-                arrival_time = r['arrival_time']
-                if len(arrival_time) == 0:
-                    continue
+            stop_id = r['stop_id']
+            stop_sequence = r['stop_sequence']
 
-                stop_id = r['stop_id']
-                stop_sequence = r['stop_sequence']
+            slist = self.stop_time_map.get(trip_id, None)
 
-                slist = self.stop_time_map.get(trip_id, None)
+            if slist is None:
+                slist = []
+                self.stop_time_map[trip_id] = slist
 
-                if slist is None:
-                    slist = []
-                    self.stop_time_map[trip_id] = slist
+            entry = {'arrival_time': util.hhmmss_to_seconds(arrival_time), 'stop_id': stop_id, 'stop_sequence': stop_sequence}
+            sdt = r.get('shape_dist_traveled', None)
 
-                entry = {'arrival_time': util.hhmmss_to_seconds(arrival_time), 'stop_id': stop_id, 'stop_sequence': stop_sequence}
-                sdt = r.get('shape_dist_traveled', None)
+            if sdt is not None and len(sdt) > 0:
+                entry['traveled'] = float(sdt)
 
-                if sdt is not None and len(sdt) > 0:
-                    entry['traveled'] = float(sdt)
+            #print(f'- entry: {entry}')
 
-                #print(f'- entry: {entry}')
+            slist.append(entry)
 
-                slist.append(entry)
 
     def get_stop_times(self, trip_id):
         return self.stop_time_map.get(trip_id, None)
 
     def get_distance(self, way_points, wi, stop_times, stops, si):
-            wp = way_points[wi]
             sp = stops[stop_times[si]['stop_id']]
-            return util.haversine_distance(wp['lat'], wp['long'], sp['lat'], sp['long'])
+            return util.haversine_distance(way_points.lat[wi], way_points.lon[wi], sp['lat'], sp['long'])
 
 
     """
@@ -396,8 +500,8 @@ class TripInference:
                     n = last_anchor_list[j + 1]
 
                 p1 = stops[stop_times[j]['stop_id']]
-                p2 = way_points[c['index']]
-                min_diff = util.haversine_distance(p1['lat'], p1['long'], p2['lat'], p2['long'])
+                wi = c['index']
+                min_diff = util.haversine_distance(p1['lat'], p1['long'], way_points.lat[wi], way_points.lon[wi])
                 min_index = c['index']
                 #print(f'-- min_index: {min_index}')
 
@@ -410,13 +514,12 @@ class TripInference:
 
                 #print(f'-- kf: {kf}, kt: {kt}')
 
-                for k in range(kf, kt):
-                    p2 = way_points[k]
-                    diff = util.haversine_distance(p1['lat'], p1['long'], p2['lat'], p2['long'])
+                if kt > kf:
+                    diff, k = util.haversine_min_distance(p1['lat'], p1['long'], way_points.lat[kf:kt], way_points.lon[kf:kt])
 
                     if diff < min_diff:
                         min_diff = diff
-                        min_index = k
+                        min_index = kf + k
 
                 #print(f'++ min_index: {min_index}')
                 anchor_list[j]['index'] = min_index
@@ -463,10 +566,7 @@ class TripInference:
                 break;
 
         if annotated:
-            for i in range(len(way_points)):
-                if not way_points[i].get('traveled', False):
-                    annotated = False
-                    break;
+            annotated = way_points.is_annotated()
 
         if not annotated:
             return self.create_anchor_list_iteratively(way_points, stop_times, stops)
@@ -481,8 +581,8 @@ class TripInference:
             min_index = -1
 
             for j in range(len(way_points)):
-                t = way_points[j]['traveled']
-                diff = math.abs(traveled - t)
+                t = way_points.traveled[j]
+                diff = abs(traveled - t)
 
                 if diff < min_difference:
                     min_difference = diff
@@ -516,7 +616,7 @@ class TripInference:
                 sp['first_stop'] = True
                 firstStop = False
 
-        util.debug(f'- anchor_list: {anchor_list}')
+        logger.debug('- anchor_list: %s', anchor_list)
         #util.debug(f'- len(anchor_list): {len(anchor_list)}')
 
         for i in range(len(anchor_list) - 1):
@@ -530,33 +630,36 @@ class TripInference:
             for j in range(idelta):
                 fraction = j / idelta
                 time = start['time'] + int(fraction * tdelta)
-                way_points[start['index'] + j]['time'] = time
-                hhmmss = util.seconds_to_hhmmss(time)
-                #util.debug(f'--- {hhmmss}')
+                way_points.time[start['index'] + j] = time
 
         #util.debug('--------------------------')
 
         index = anchor_list[0]['index']
         time = anchor_list[0]['time']
 
-        while index >= 0:
+        while index > 0:
             index -= 1
-            way_points[index]['time'] = time
+            way_points.time[index] = time
 
         index = anchor_list[-1]['index']
         time = anchor_list[-1]['time']
 
         while index < len(way_points):
-            way_points[index]['time'] = time
+            way_points.time[index] = time
             index += 1
 
         ### REMOVE ME: for testing only
         for i in range(len(way_points)):
-            if not 'time' in way_points[i]:
-                util.debug(f'.. {i}')
+            if way_points.time[i] == NO_TIME:
+                logger.debug('.. %s', i)
 
-    def make_trip_segments(self, trip_id, trip_name, first_stop, way_points, max_segment_length):
-        #print(f'- make_trip_segments()')
+    """
+    Splits shape `shape_id` into segments of about max_segment_length feet and adds them
+    to the grid. Segments only depend on the shape's geometry, so they are created once
+    and shared by all trips running over the shape, see add_trip().
+    """
+    def make_shape_segments(self, shape_id, way_points, max_segment_length):
+        #print(f'- make_shape_segments()')
         #print(f'- max_segment_length: {max_segment_length}')
         #print(f'- way_points: {way_points}')
 
@@ -564,51 +667,48 @@ class TripInference:
         index = segment_start
         last_index = index
         segment_length = 0
-        first_segment = True
         segment_count = 1
 
-        area = Area()
+        # bounding box of the current segment
+        min_lat = min_lon = float('inf')
+        max_lat = max_lon = float('-inf')
         index_list = []
         segment_list = []
 
         skirt_size = max(int(max_segment_length / 10), 500)
         #print(f'- skirt_size: {skirt_size}')
+        lat_skirt = util.get_feet_as_lat_degrees(skirt_size / 2)
+        lon_skirt = util.get_feet_as_long_degrees(skirt_size / 2)
 
         while index < len(way_points):
-            lp = way_points[last_index]
-            p = way_points[index]
+            lat = way_points.lat[index]
+            lon = way_points.lon[index]
 
-            area.update(p['lat'], p['long'])
+            min_lat = min(min_lat, lat)
+            max_lat = max(max_lat, lat)
+            min_lon = min(min_lon, lon)
+            max_lon = max(max_lon, lon)
 
-            grid_index = self.grid.get_index(p['lat'], p['long'])
+            grid_index = self.grid.get_index(lat, lon)
             if not grid_index in index_list:
                 index_list.append(grid_index)
 
-            distance = util.haversine_distance(lp['lat'], lp['long'], p['lat'], p['long'])
+            distance = way_points.distance[index] - way_points.distance[last_index]
             segment_length += distance
 
             if segment_length >= max_segment_length or index == len(way_points) - 1:
-                area.extend(skirt_size)
-
-                if segment_start == 0 and way_points[segment_start]['time'] == way_points[index]['time']:
-                    util.error(f'0 duration first segment for trip {trip_id}')
-
-                stop_id = None
-                if first_segment:
-                    first_segment = False
-                    stop_id = first_stop['stop_id']
-
                 segment = Segment(
                     segment_count,
-                    trip_id,
-                    trip_name,
-                    first_stop['arrival_time'],
-                    stop_id,
-                    area,
-                    way_points[segment_start]['time'],
-                    way_points[index]['time'],
-                    way_points[segment_start]['file_offset'],
-                    way_points[index]['file_offset']
+                    shape_id,
+                    min_lat - lat_skirt,
+                    max_lat + lat_skirt,
+                    min_lon - lon_skirt,
+                    max_lon + lon_skirt,
+                    segment_start,
+                    index,
+                    way_points.file_offset[segment_start],
+                    way_points.file_offset[index],
+                    self.projection
                 )
 
                 segment_list.append(segment)
@@ -618,15 +718,15 @@ class TripInference:
                     self.grid.add_segment(segment, i)
 
                 segment_length = 0
-                area = Area()
                 index_list = []
 
                 index += 1
                 last_index = index
                 segment_start = index
 
-                p = way_points[max(segment_start - 1, 0)]
-                area.update(p['lat'], p['long'])
+                i = max(segment_start - 1, 0)
+                min_lat = max_lat = way_points.lat[i]
+                min_lon = max_lon = way_points.lon[i]
 
                 continue
 
@@ -636,61 +736,174 @@ class TripInference:
         for s in segment_list:
             s.set_segments_per_trip(segment_count - 1)
 
-    # NOTE: brute force approach that returns the *first*
-    # stop within max_distance feet from lat/lon
-    def get_stop_for_position(self, lat, lon, max_distance):
-        stop_id = None
+        return segment_list
 
-        for id in self.stops:
-            stop = self.stops[id]
-            if util.haversine_distance(lat, lon, stop['lat'], stop['long']) < max_distance:
-                stop_id = id
-                break
+    # adds a trip over the segments of its shape, with segment times taken from the
+    # interpolated `way_points` times. Trips with the same times relative to their
+    # first stop share a TimePattern
+    def add_trip(self, trip_id, trip_name, service_id, first_stop, way_points, segment_list):
+        first = segment_list[0]
+
+        if way_points.time[first.first_point] == way_points.time[first.last_point]:
+            util.error(f'0 duration first segment for trip {trip_id}')
+
+        start_seconds = first_stop['arrival_time']
+        starts = array('l', [way_points.time[s.first_point] - start_seconds for s in segment_list])
+        ends = array('l', [way_points.time[s.last_point] - start_seconds for s in segment_list])
+        shape_id = first.shape_id
+        key = (shape_id, starts.tobytes(), ends.tobytes())
+        pattern = self.time_patterns.get(key, None)
+
+        if pattern is None:
+            pattern = TimePattern(shape_id, starts, ends)
+            self.time_patterns[key] = pattern
 
+        trip = Trip(trip_id, trip_name, service_id, start_seconds, pattern)
+
+        for s in segment_list:
+            s.add_trip(trip)
+
+    # returns the closest stop within max_distance feet from lat/lon
+    def get_stop_for_position(self, lat, lon, max_distance):
+        stop_id, distance = self.stop_index.get_nearest(lat, lon, max_distance)
         return stop_id
 
     def reset_scoring(self):
-        util.debug('+++ reset scoring! +++')
-        self.trip_candidates = {}
-        self.last_candidate_flush = time.time()
+        logger.debug('+++ reset scoring! +++')
+        self.scoreboard.clear()
 
+    # returns None for trips without block or stop times
+    def get_block_id_for_trip(self, trip_id):
+        return self.trip_blocks.get(trip_id, None)
 
-    def check_for_trip_start(self, stop_id):
-        if not stop_id in self.stops:
-            return
+    # returns the ID of the trip following `trip_id` in its block among trips with
+    # a service in `active_services`, None if there is no such trip
+    def get_next_trip_in_block(self, trip_id, active_services):
+        block_id = self.get_block_id_for_trip(trip_id)
 
-        stop = self.stops[stop_id]
-        delta = time.time() - self.last_candidate_flush
+        if block_id is None:
+            return None
 
-        if 'first_stop' in stop and delta >= MIN_FLUSH_TIME_DELTA:
-            self.reset_scoring()
+        trip_list = self.block_map[block_id]
+        found = False
+
+        for t in trip_list:
+            if found and t.get('service_id', None) in active_services:
+                return t['trip_id']
+            if t['trip_id'] == trip_id:
+                found = True
 
-    # returns None for trips filtered out for unmatched day or week,
-    # calendar validity period, etc.
-    def get_block_id_for_trip(self, trip_id):
-        for b in self.block_map:
-            trip_list = self.block_map[b]
-            for t in trip_list:
-                if t['trip_id'] == trip_id:
-                    return b
         return None
 
+    # returns the segments of `trip` containing lat/lon with a time window of the trip covering `seconds`.
+    # Way point times increase along a shape, so pattern starts and ends are sorted and the segments
+    # whose window can cover `seconds` are found by bisection
+    def get_trip_candidates(self, trip, lat, lon, seconds):
+        segment_list = self.shape_segments[trip.get_shape_id()]
+        pattern = trip.pattern
+        offset = seconds - trip.start_seconds
+        lo = bisect_left(pattern.ends, offset - MAX_TIME_DISTANCE)
+        hi = bisect_right(pattern.starts, offset + MAX_TIME_DISTANCE, lo)
+        candidate_list = []
+
+        for i in range(lo, hi):
+            segment = segment_list[i]
+            start, end = segment.get_time_window(trip)
+
+            if start <= seconds <= end and segment.contains(lat, lon):
+                candidate_list.append(segment)
+
+        return candidate_list
+
+    """
+    Fast path for a trip assigned through block data. Only looks at segments of
+    the shape of that trip, with a time window of the trip covering `seconds`.
+    Once `seconds` reaches the time window of the trip's last segment, the next
+    trip of the same block is staged: the way points of its first segment are
+    loaded, and from then on its segments are considered as well, so that
+    inference can follow the vehicle into the next trip before the assignment
+    is updated. Returns the candidate segments and the IDs of the trips to
+    score them for.
+    """
+    def get_assigned_trip_candidates(self, trip_id, lat, lon, seconds, active_services):
+        trip = self.trips.get(trip_id, None)
+
+        if trip is None:
+            return [], None
+
+        # staging is relative to the assigned trip
+        if self.staged_for_trip_id != trip_id:
+            self.staged_for_trip_id = trip_id
+            self.staged_trip_id = None
+
+        last_start, last_end = self.shape_segments[trip.get_shape_id()][-1].get_time_window(trip)
+
+        if self.staged_trip_id is None and seconds >= last_start:
+            self.staged_trip_id = self.get_next_trip_in_block(trip_id, active_services)
+
+            if self.staged_trip_id is not None:
+                logger.debug('- staged next trip in block: %s', self.staged_trip_id)
+                staged_trip = self.trips.get(self.staged_trip_id, None)
+
+                if staged_trip is not None:
+                    self.shape_segments[staged_trip.get_shape_id()][0].get_way_points(self.path)
+
+        candidate_list = self.get_trip_candidates(trip, lat, lon, seconds)
+        trip_ids = {trip_id}
+
+        if self.staged_trip_id is not None:
+            staged_trip = self.trips.get(self.staged_trip_id, None)
+
+            if staged_trip is not None:
+                trip_ids.add(self.staged_trip_id)
+
+                # trips of a block often run over the same shape
+                for segment in self.get_trip_candidates(staged_trip, lat, lon, seconds):
+                    if not segment in candidate_list:
+                        candidate_list.append(segment)
+
+        return candidate_list, trip_ids
+
+    """
+    Returns stop time entities for the remaining stops of trip `trip_id`, all with delay `offset`.
+    Only stops that haven't been published yet, or whose delay moved by more than
+    self.delay_tolerance seconds since it was last published, are included, so that an
+    empty list means there is nothing new to upload. Published delays are only tracked
+    for the most recent trip. Callers should call invalidate_stop_time_entities() if
+    uploading the returned entities fails.
+    """
     def get_stop_time_entities(self, trip_id, day_seconds, offset):
-        util.debug(f'get_stop_time_entities()')
-        util.debug(f'- trip_id: {trip_id}')
-        util.debug(f'- day_seconds: {day_seconds}')
-        util.debug(f'- offset: {offset}')
+        logger.debug('get_stop_time_entities()')
+        logger.debug('- trip_id: %s', trip_id)
+        logger.debug('- day_seconds: %s', day_seconds)
+        logger.debug('- offset: %s', offset)
 
         index = self.get_remaining_stops_index(trip_id, day_seconds + offset)
-        util.debug(f'- index: {index}')
+        logger.debug('- index: %s', index)
         stop_list = self.stop_time_map.get(trip_id, [])
-        util.debug(f'- stop_list: {stop_list}')
+        logger.debug('- stop_list: %s', stop_list)
         entities = []
         timestamp = int(time.time())
 
+        if index is None:
+            return entities
+
+        published = self.published_delays.get(trip_id, None)
+
+        if published is None:
+            published = {}
+            self.published_delays = {trip_id: published}
+
         for i in range(index, len(stop_list)):
             s = stop_list[i]
-            util.debug(f'-- s: {s}')
+            logger.debug('-- s: %s', s)
+
+            last_delay = published.get(s['stop_sequence'], None)
+
+            if last_delay is not None and abs(offset - last_delay) <= self.delay_tolerance:
+                continue
+
+            published[s['stop_sequence']] = offset
 
             e = {
                 'agency_id': self.agency_id,
@@ -703,56 +916,92 @@ class TripInference:
 
             entities.append(e)
 
-        util.debug(f'- entities: {entities}')
+        logger.debug('- entities: %s', entities)
+        logger.debug('- changed stop time entities: %s/%s', len(entities), len(stop_list) - index)
         return entities
 
+    # forgets published delays for `trip_id`, or for all trips if None,
+    # so that the next call to get_stop_time_entities() returns all remaining stops
+    def invalidate_stop_time_entities(self, trip_id = None):
+        if trip_id is None:
+            self.published_delays = {}
+        else:
+            self.published_delays.pop(trip_id, None)
+
     # assumes that stop_list entries are sorted by 'arrival_time'
     def get_remaining_stops_index(self, trip_id, day_seconds):
-        util.debug(f'get_remaining_stops_index()')
-        util.debug(f'- trip_id: {trip_id}')
-        util.debug(f'- day_seconds: {day_seconds}')
+        logger.debug('get_remaining_stops_index()')
+        logger.debug('- trip_id: %s', trip_id)
+        logger.debug('- day_seconds: %s', day_seconds)
 
         stop_list = self.stop_time_map.get(trip_id, None)
-        util.debug(f'- stop_list: {stop_list}')
-        result = []
+        logger.debug('- stop_list: %s', stop_list)
 
         if stop_list is None:
             return None
 
-        for i in range(len(stop_list)):
-            if stop_list[i]['arrival_time'] >= day_seconds:
-                return i
+        arrival_times = self.arrival_times.get(trip_id, None)
+
+        # only kept for the current trip, like published delays
+        if arrival_times is None:
+            arrival_times = array('l', [s['arrival_time'] for s in stop_list])
+            self.arrival_times = {trip_id: arrival_times}
+
+        return bisect_left(arrival_times, day_seconds)
+
+    # returns the SegmentBatch for the grid cell containing lat/lon, None if the cell has no segments
+    def get_segment_batch(self, lat, lon):
+        index = self.grid.get_index(lat, lon)
+        batch = self.segment_batches.get(index, None)
 
-        return len(stop_list)
+        if batch is None:
+            segment_list = self.grid.get_segment_list(lat, lon)
 
-    def get_trip_id(self, lat, lon, seconds, trip_id_from_block = None):
-        segment_list = self.grid.get_segment_list(lat, lon)
+            if segment_list is None:
+                return None
+
+            batch = SegmentBatch(segment_list)
+            self.segment_batches[index] = batch
+
+        return batch
+
+    # `date` is the service date for `seconds`, defaults to today. Besides the trip ID and
+    # stop time entities, returns the ID of the closest stop within STOP_PROXIMITY feet, if any
+    def get_trip_id(self, lat, lon, seconds, trip_id_from_block = None, date = None):
         ret = {
             'trip_id': None,
-            'stop_time_entities': None
+            'stop_time_entities': None,
+            'stop_id': self.get_stop_for_position(lat, lon, STOP_PROXIMITY)
         }
 
-        if segment_list is None:
-            return ret
+        if trip_id_from_block is None:
+            batch = self.get_segment_batch(lat, lon)
 
-        util.debug(f'- len(segment_list): {len(segment_list)}')
-        #util.debug(f'- trip_id_from_block: {trip_id_from_block}')
+            if batch is None:
+                return ret
 
-        stop_id = self.get_stop_for_position(lat, lon, STOP_PROXIMITY)
+            logger.debug('- len(segment_list): %s', len(batch.segments))
+
+        #util.debug(f'- trip_id_from_block: {trip_id_from_block}')
 
         multiplier = 1
         ### removing stop multiplier actually gives better results with training data set
-        #if stop_id is not None:
-        #    multiplier = 10
 
-        max_segment_score = 0
+        if date is None:
+            date = datetime.date.today()
+
+        active_services = self.calendar.get_active_services(date)
+        self.scoreboard.advance(seconds)
+
         time_offset = 0
 
-        for segment in segment_list:
-            if trip_id_from_block is not None and segment.trip_id != trip_id_from_block:
-                continue
+        if trip_id_from_block is None:
+            segment_list = batch.get_candidates(lat, lon, seconds)
+            trip_ids = None
+        else:
+            segment_list, trip_ids = self.get_assigned_trip_candidates(trip_id_from_block, lat, lon, seconds, active_services)
 
-            result = segment.get_score(lat, lon, seconds, self.path)
+        for segment, trip, result in get_scores(segment_list, lat, lon, seconds, self.path, active_services, trip_ids):
             score = multiplier * result['score']
             time_offset = result['time_offset']
             #util.debug(f'-- time_offset: {time_offset}')
@@ -760,41 +1009,22 @@ class TripInference:
             if score <= 0:
                 continue
 
-            if score > max_segment_score:
-                max_segment_score = score
+            self.scoreboard.add(trip.id, score, trip.name, time_offset)
 
-            trip_id = segment.get_trip_id()
+        logger.debug('- waypoint cache: %s', Segment.waypoint_cache)
 
-            if trip_id in self.trip_candidates:
-                candidate = self.trip_candidates[trip_id]
-            else:
-                candidate = {'score': 0, 'name': segment.trip_name}
-                self.trip_candidates[trip_id] = candidate
+        if logger.is_enabled(log.DEBUG):
+            for trip_id, cand in self.scoreboard.items():
+                logger.debug('candidate update: id=%s trip-name=%s score=%s', trip_id, util.to_b64(cand['name']), self.scoreboard.get_score(cand))
 
-            candidate['score'] += score
-            candidate['time_offset'] = time_offset
-            #util.debug(f'-- candidate["time_offset"]: {candidate["time_offset"]}')
+        max_score = 0
+        max_trip_id, cand = self.scoreboard.get_leader()
 
-        if max_segment_score > 0 and stop_id is not None:
-            self.check_for_trip_start(stop_id)
+        if cand is not None:
+            max_score = self.scoreboard.get_score(cand)
+            cand_time_offset = cand['time_offset']
 
-        max_score = 0
-        max_trip_id = None
-        cand_time_offset = None
-
-        for trip_id in self.trip_candidates:
-            cand = self.trip_candidates[trip_id]
-            score = cand['score']
-            name = cand['name']
-            util.debug(f'candidate update: id={trip_id} trip-name={util.to_b64(name)} score={score}')
-
-            if score > max_score:
-                max_score = score
-                max_trip_id = trip_id
-                cand_time_offset = cand['time_offset']
-                #util.debug(f'-- cand_time_offset: {cand_time_offset}')
-
-        util.debug(f'- max_score: {max_score}')
+        logger.debug('- max_score: %s', max_score)
 
         if max_score >= SCORE_THRESHOLD:
             ret['trip_id'] = max_trip_id
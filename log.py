@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+
+"""
+Leveled logging with per-module levels and lazy formatting, plus result events.
+
+Loggers are obtained by module name, e.g. log.get_logger('inference'). Messages
+use %-style arguments that are only formatted if the message is emitted:
+
+    logger.debug('- trip_id: %s', trip_id)
+
+Disabled levels are bound to a no-op, so a disabled call costs one function call
+plus evaluation of its arguments. Arguments that are expensive to compute should
+be guarded with logger.is_enabled(log.DEBUG).
+
+Levels are set through the GRAAS_LOG environment variable, a comma separated list
+of a default level and optional <module>=<level> overrides:
+
+    GRAAS_LOG=info,inference=debug,segment=debug
+
+Result events (e.g. the inferred trip ID per update) are structured records that
+tools consume. They are routed to a result sink independently of log levels,
+see set_result_sink(). Which events are enabled by default is set with the
+GRAAS_RESULTS environment variable, a comma separated list of event names or
+'all', defaulting to TRIP_ID.
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+DEFAULT_LEVEL = INFO
+
+# result events
+TRIP_ID = 'trip_id'
+SEGMENT_UPDATE = 'segment update'
+STOP_ID = 'stop_id'
+DEFAULT_RESULTS = TRIP_ID
+
+loggers = {}
+default_level = DEFAULT_LEVEL
+module_levels = {}
+
+last_second = -1
+last_timestamp = ''
+
+def get_timestamp():
+    global last_second
+    global last_timestamp
+
+    now = int(time.time())
+
+    if now != last_second:
+        last_second = now
+        last_timestamp = time.strftime('%H:%M:%S ', time.localtime(now))
+
+    return last_timestamp
+
+def write(s):
+    print(get_timestamp() + s)
+    sys.stdout.flush()
+
+def noop(*args):
+    pass
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+        self.set_level(module_levels.get(name, default_level))
+
+    def set_level(self, level):
+        self.level = level
+        self.debug = self.log_debug if level <= DEBUG else noop
+        self.info = self.log_info if level <= INFO else noop
+        self.warning = self.log_warning if level <= WARNING else noop
+        self.error = self.log_error if level <= ERROR else noop
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def format(self, msg, args):
+        return str(msg) % args if len(args) > 0 else str(msg)
+
+    def log_debug(self, msg, *args):
+        write(self.format(msg, args))
+
+    def log_info(self, msg, *args):
+        write(self.format(msg, args))
+
+    def log_warning(self, msg, *args):
+        write('* ' + self.format(msg, args))
+
+    def log_error(self, msg, *args):
+        write('*** ' + self.format(msg, args))
+
+def get_logger(name):
+    logger = loggers.get(name, None)
+
+    if logger is None:
+        logger = Logger(name)
+        loggers[name] = logger
+
+    return logger
+
+# sets the level of module `name`, or the default level for all modules without override if None
+def set_level(level, name = None):
+    global default_level
+
+    if name is None:
+        default_level = level
+        for n in loggers:
+            if not n in module_levels:
+                loggers[n].set_level(level)
+    else:
+        module_levels[name] = level
+        get_logger(name).set_level(level)
+
+# applies a level spec like 'info,inference=debug'
+def configure(spec):
+    for item in spec.split(','):
+        item = item.strip()
+
+        if len(item) == 0:
+            continue
+
+        name = None
+        i = item.find('=')
+
+        if i > 0:
+            name = item[:i].strip()
+            item = item[i + 1:].strip()
+
+        level = LEVELS.get(item.lower(), None)
+
+        if level is None:
+            print(f'*** unknown log level \'{item}\' in \'{spec}\'')
+            continue
+
+        set_level(level, name)
+
+def format_result(event, fields):
+    if event == TRIP_ID:
+        return f'- trip_id: {fields["trip_id"]}'
+
+    return event + ': ' + ' '.join(f'{k}={fields[k]}' for k in fields)
+
+# default sink, result lines with timestamp like other log output
+def timestamped_sink(event, fields):
+    write(format_result(event, fields))
+
+# result lines as is, for tools that parse them
+def plain_sink(event, fields):
+    print(format_result(event, fields))
+
+result_sink = timestamped_sink
+result_events = set()
+
+# `sink` is called with event name and field dict, `events` is a collection of
+# event names to enable, or None for all
+def set_result_sink(sink, events = None):
+    global result_sink
+    global result_events
+
+    result_sink = sink
+    result_events = events if events is None else set(events)
+
+def is_result_enabled(event):
+    return result_events is None or event in result_events
+
+def result(event, fields):
+    if result_events is None or event in result_events:
+        result_sink(event, fields)
+
+configure(os.getenv('GRAAS_LOG', ''))
+
+results = os.getenv('GRAAS_RESULTS', DEFAULT_RESULTS)
+result_events = None if results == 'all' else set(e.strip() for e in results.split(',') if len(e.strip()) > 0)
@@ -0,0 +1,156 @@
+"""
+Reports memory used by trip inference data structures for a GTFS archive, e.g.:
+
+    python mem-report.py ~/tmp/gtfs-cache/gtfs.zip [<cache-folder>]
+
+With a cache folder, the model for the archive is built there as well, and its
+segments and trips are measured.
+
+Sizes are measured with tracemalloc and compare the current representation
+against the one it replaced.
+"""
+
+import gc
+import inference
+import log
+import platform
+import sys
+import tracemalloc
+from area import Area
+from segment import Segment
+from shapepoint import ShapePoint
+from shapestore import ShapeStore, NO_VALUE
+from trip import Trip
+
+SHAPE_COLUMNS = ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_dist_traveled']
+
+def measure(name, build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{name:<32} {int(size / 1024):>9} KB')
+    return result, size
+
+# previous representation: one dict per shape point
+def load_shape_dicts(zip_path):
+    shape_map = {}
+
+    for file_offset, r in platform.read_zip_table(zip_path, 'shapes.txt', True, SHAPE_COLUMNS):
+        plist = shape_map.get(r['shape_id'], None)
+
+        if plist is None:
+            plist = []
+            shape_map[r['shape_id']] = plist
+
+        entry = {'lat': float(r['shape_pt_lat']), 'long': float(r['shape_pt_lon']), 'file_offset': file_offset, 'distance': 0.0}
+        sdt = r.get('shape_dist_traveled', None)
+
+        if sdt is not None and len(sdt) > 0:
+            entry['traveled'] = float(sdt)
+
+        entry['time'] = 0
+        plist.append(entry)
+
+    return shape_map
+
+def load_shape_store(zip_path):
+    store = ShapeStore()
+
+    for file_offset, r in platform.read_zip_table(zip_path, 'shapes.txt', True, SHAPE_COLUMNS):
+        traveled = NO_VALUE
+        sdt = r.get('shape_dist_traveled', None)
+
+        if sdt is not None and len(sdt) > 0:
+            traveled = float(sdt)
+
+        store.get_or_create_shape(r['shape_id']).append(float(r['shape_pt_lat']), float(r['shape_pt_lon']), file_offset, 0.0, traveled)
+
+    return store
+
+# previous representation: instance __dict__ each, bounding box as an Area with two ShapePoints
+class DictShapePoint:
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+class DictArea:
+    def __init__(self, tl, br):
+        self.top_left = tl
+        self.bottom_right = br
+
+class DictObject:
+    def __init__(self, fields):
+        for name in fields:
+            setattr(self, name, fields[name])
+
+def copy_dict_segments(segments):
+    result = []
+
+    for s in segments:
+        fields = {name: getattr(s, name) for name in Segment.__slots__ if not name in ['min_lat', 'max_lat', 'min_lon', 'max_lon']}
+        fields['bounding_box'] = DictArea(DictShapePoint(s.max_lat, s.min_lon), DictShapePoint(s.min_lat, s.max_lon))
+        result.append(DictObject(fields))
+
+    return result
+
+def copy_slot_segments(segments):
+    result = []
+
+    for s in segments:
+        c = Segment(s.segment_index, s.shape_id, s.min_lat, s.max_lat, s.min_lon, s.max_lon, s.first_point, s.last_point, s.min_file_offset, s.max_file_offset, s.projection)
+        c.trips = s.trips
+        c.window = s.window
+        c.window_starts = s.window_starts
+        c.window_ends = s.window_ends
+        c.max_window = s.max_window
+        c.segments_per_trip = s.segments_per_trip
+        result.append(c)
+
+    return result
+
+def report_model(zip_path, cache_folder):
+    log.set_level(log.WARNING)
+    inf = inference.TripInference(cache_folder, zip_path, 'mem-report', 'mem-report')
+    segments = [s for shape_id in inf.shape_segments for s in inf.shape_segments[shape_id]]
+    trips = list(inf.trips.values())
+
+    copies, dict_size = measure('segments, __dict__ + Area', lambda: copy_dict_segments(segments))
+    copies = None
+    copies, slot_size = measure('segments, __slots__', lambda: copy_slot_segments(segments))
+    copies = None
+    print(f'- segments: {len(segments)}, {int(dict_size / len(segments))} vs {int(slot_size / len(segments))} bytes per segment')
+
+    copies, dict_size = measure('trips, __dict__', lambda: [DictObject({name: getattr(t, name) for name in Trip.__slots__}) for t in trips])
+    copies = None
+    copies, slot_size = measure('trips, __slots__', lambda: [Trip(t.id, t.name, t.service_id, t.start_seconds, t.pattern) for t in trips])
+    copies = None
+    print(f'- trips: {len(trips)}, {int(dict_size / len(trips))} vs {int(slot_size / len(trips))} bytes per trip')
+
+    areas, dict_size = measure('areas, __dict__', lambda: [DictArea(DictShapePoint(0., 0.), DictShapePoint(1., 1.)) for i in range(len(segments))])
+    areas = None
+    areas, slot_size = measure('areas, __slots__', lambda: [Area(ShapePoint(0., 0.), ShapePoint(1., 1.)) for i in range(len(segments))])
+    areas = None
+    print(f'- areas: {len(segments)}, {int(dict_size / len(segments))} vs {int(slot_size / len(segments))} bytes per area')
+
+def main(zip_path, cache_folder = None):
+    print(f'- zip_path: {zip_path}')
+
+    shape_map, dict_size = measure('shapes, dict per point', lambda: load_shape_dicts(zip_path))
+    count = sum(len(shape_map[k]) for k in shape_map)
+    shape_map = None
+
+    store, store_size = measure('shapes, ShapeStore', lambda: load_shape_store(zip_path))
+    print(f'- shape points: {count}, {int(dict_size / count)} vs {int(store_size / count)} bytes per point')
+    store = None
+
+    if cache_folder is not None:
+        report_model(zip_path, cache_folder)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} <gtfs-zip> [<cache-folder>]')
+        exit(1)
+
+    main(*sys.argv[1:3])
@@ -0,0 +1,150 @@
+"""
+Local stand-in for the graas server, to test and time uploads without the
+backend. Serves HTTPS with a self-signed certificate generated through openssl
+(or plain HTTP with -n) and answers every POST with an empty JSON object. Accepts
+gzip'ed bodies and batched positions (new-pos-batch), e.g.:
+
+    python mock-server.py -p 8443 -d 50
+
+and point graas-bt.py or upload-bench.py at https://localhost:8443/, passing
+the certificate printed on startup for verification. Prints request count,
+connections, positions and bytes received every few seconds.
+
+    -p <port>: port to listen on, defaults to 8443
+    -d <delay>: milliseconds to wait before responding, defaults to 0
+    -n: serve plain HTTP
+"""
+
+import gzip
+import http.server
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPORT_INTERVAL = 5 # seconds
+
+lock = threading.Lock()
+stats = {
+    'requests': 0,
+    'connections': 0,
+    'positions': 0,
+    'bytes': 0
+}
+delay = 0
+
+def count(name, value = 1):
+    lock.acquire()
+    stats[name] += value
+    lock.release()
+
+# creates a self-signed certificate for localhost, returns (cert file, key file)
+def make_cert(folder):
+    cert = os.path.join(folder, 'cert.pem')
+    key = os.path.join(folder, 'key.pem')
+
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+        '-nodes', '-days', '1', '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+        '-keyout', key, '-out', cert
+    ], check = True, capture_output = True)
+
+    return cert, key
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # keep-alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        count('connections')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        count('requests')
+        count('bytes', len(body))
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        try:
+            msg = json.loads(body)['data']
+            count('positions', len(msg['positions']) if 'positions' in msg else 1 if 'lat' in msg else 0)
+        except:
+            self.send_error(400)
+            return
+
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        data = json.dumps({}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def report():
+    last = 0
+
+    while True:
+        time.sleep(REPORT_INTERVAL)
+        lock.acquire()
+        s = dict(stats)
+        lock.release()
+
+        if s['requests'] != last:
+            per_position = s['bytes'] / max(s['positions'], 1)
+            print(f'- requests: {s["requests"]}, connections: {s["connections"]}, positions: {s["positions"]}, bytes: {s["bytes"]} ({per_position:.1f} per position)')
+            last = s['requests']
+
+def main(port, plain):
+    server = http.server.ThreadingHTTPServer(('localhost', port), Handler)
+    scheme = 'http'
+
+    if not plain:
+        folder = tempfile.mkdtemp()
+        cert, key = make_cert(folder)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side = True)
+        scheme = 'https'
+        print(f'- cert: {cert}')
+
+    print(f'- listening on {scheme}://localhost:{port}/, delay: {delay} ms')
+    threading.Thread(target = report, daemon = True).start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    port = 8443
+    plain = False
+    i = 1
+
+    while i < len(sys.argv):
+        if sys.argv[i] == '-p' and i < len(sys.argv) - 1:
+            i += 1
+            port = int(sys.argv[i])
+        elif sys.argv[i] == '-d' and i < len(sys.argv) - 1:
+            i += 1
+            delay = int(sys.argv[i])
+        elif sys.argv[i] == '-n':
+            plain = True
+        else:
+            print(f'usage: {sys.argv[0]} [-p <port>] [-d <delay-ms>] [-n]')
+            exit(1)
+        i += 1
+
+    main(port, plain)
@@ -0,0 +1,137 @@
+"""
+Replays recorded NMEA over a pseudo-terminal, the way a GPS modem streams it over
+serial, to test NmeaReader (or graas-bt.py) without hardware, e.g.:
+
+    python nmea-replay.py -g 120 > /tmp/drive.nmea
+    python nmea-replay.py /tmp/drive.nmea
+
+prints the pty to open as the serial device, and replays sentences one epoch
+(sentences sharing a UTC time) per second. With -c it instead reads the pty
+itself through NmeaReader and prints each fix and the reader stats at the end.
+
+    -g <seconds>: write a synthetic recording of a vehicle driving north-east
+    -c: check mode, read the replay back through NmeaReader
+    -x <speedup>: replay that many epochs per second
+"""
+
+import math
+import os
+import serial
+import sys
+import time
+import tty
+from datetime import datetime, timezone
+from nmea import NmeaReader, get_checksum, parse_sentence
+
+def make_sentence(body):
+    return f'${body}*{get_checksum(body):02X}\r\n'
+
+def to_nmea(degrees, digits):
+    d = int(abs(degrees))
+    m = (abs(degrees) - d) * 60
+    return f'{d:0{digits}d}{m:09.6f}'
+
+# writes `seconds` epochs of GGA/RMC/VTG for a vehicle at ~10 m/s, heading 45 degrees
+def generate(seconds):
+    lat = 37.7749
+    lon = -122.4194
+    start = int(time.time())
+
+    for i in range(seconds):
+        dt = datetime.fromtimestamp(start + i, timezone.utc)
+        t = dt.strftime('%H%M%S') + '.00'
+        d = dt.strftime('%d%m%y')
+        speed = 10 + 2 * math.sin(i / 10)
+        heading = 45.0
+        lat_s = to_nmea(lat, 2) + ',' + ('N' if lat >= 0 else 'S')
+        lon_s = to_nmea(lon, 3) + ',' + ('E' if lon >= 0 else 'W')
+
+        sys.stdout.write(make_sentence(f'GPGGA,{t},{lat_s},{lon_s},1,08,{0.8 + (i % 5) / 10:.1f},12.0,M,-25.0,M,,'))
+        sys.stdout.write(make_sentence(f'GPRMC,{t},A,{lat_s},{lon_s},{speed / 0.514444:.1f},{heading:.1f},{d},,,A'))
+        sys.stdout.write(make_sentence(f'GPVTG,{heading:.1f},T,,M,{speed / 0.514444:.1f},N,{speed * 3.6:.1f},K,A'))
+
+        step = speed / math.sqrt(2)
+        lat += step / 111111
+        lon += step / (111111 * math.cos(math.radians(lat)))
+
+# returns lists of lines that share a UTC time
+def get_epochs(path):
+    epochs = []
+    current = None
+
+    with open(path) as f:
+        for line in f:
+            fields = parse_sentence(line)
+            t = fields[1] if fields is not None and len(fields) > 1 and fields[0][2:] in ['RMC', 'GGA'] else None
+
+            if len(epochs) == 0 or (t is not None and current is not None and t != current):
+                epochs.append([])
+
+            if t is not None:
+                current = t
+
+            epochs[-1].append(line.rstrip('\r\n') + '\r\n')
+
+    return epochs
+
+def replay(master, epochs, speedup):
+    for epoch in epochs:
+        os.write(master, ''.join(epoch).encode('ascii'))
+        time.sleep(1 / speedup)
+
+def main(path, check, speedup):
+    epochs = get_epochs(path)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    print(f'- replaying {len(epochs)} epochs on {name}')
+
+    if not check:
+        replay(master, epochs, speedup)
+        return
+
+    ser = serial.Serial(name, 115200, timeout = 1)
+    reader = NmeaReader(ser)
+    reader.start()
+
+    last = None
+    for epoch in epochs:
+        os.write(master, ''.join(epoch).encode('ascii'))
+        time.sleep(1 / speedup)
+
+        start = time.perf_counter()
+        fix = reader.get_fix()
+        elapsed = time.perf_counter() - start
+
+        if fix != last:
+            print(f'{fix} ({1000000 * elapsed:.1f} us)')
+            last = fix
+
+    reader.stop()
+    ser.close()
+    print(f'- reader: {reader}')
+
+if __name__ == '__main__':
+    path = None
+    check = False
+    speedup = 1
+    i = 1
+
+    while i < len(sys.argv):
+        if sys.argv[i] == '-g' and i < len(sys.argv) - 1:
+            generate(int(sys.argv[i + 1]))
+            exit(0)
+        elif sys.argv[i] == '-c':
+            check = True
+        elif sys.argv[i] == '-x' and i < len(sys.argv) - 1:
+            i += 1
+            speedup = float(sys.argv[i])
+        else:
+            path = sys.argv[i]
+        i += 1
+
+    if path is None:
+        print(f'usage: {sys.argv[0]} [-c] [-x <speedup>] <nmea-file> | -g <seconds>')
+        exit(1)
+
+    main(path, check, speedup)
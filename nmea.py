@@ -0,0 +1,210 @@
+import log
+import threading
+import time
+from datetime import datetime, timezone
+
+KNOTS_TO_MPS = 0.514444
+KMH_TO_MPS = 1 / 3.6
+# typical user equivalent range error of a consumer GPS receiver, accuracy is estimated as HDOP * UERE
+UERE = 5 # meters
+DEFAULT_MAX_AGE = 5 # seconds
+
+logger = log.get_logger('nmea')
+
+# returns the XOR checksum of the characters between '$' and '*'
+def get_checksum(body):
+    checksum = 0
+
+    for c in body:
+        checksum ^= ord(c)
+
+    return checksum
+
+# returns the fields of NMEA sentence `line`, or None if it is malformed or fails its checksum
+def parse_sentence(line):
+    line = line.strip()
+
+    if len(line) < 4 or line[0] != '$':
+        return None
+
+    star = line.rfind('*')
+
+    if star < 0 or len(line) - star != 3:
+        return None
+
+    body = line[1:star]
+
+    try:
+        if int(line[star + 1:], 16) != get_checksum(body):
+            return None
+    except ValueError:
+        return None
+
+    return body.split(',')
+
+# converts NMEA [d]ddmm.mmmm and N/S/E/W to signed decimal degrees
+def get_degrees(value, hemisphere):
+    dot = value.find('.')
+    if dot < 0:
+        dot = len(value)
+
+    degrees = int(value[:dot - 2]) + float(value[dot - 2:]) / 60
+
+    if hemisphere == 'S' or hemisphere == 'W':
+        degrees = -degrees
+
+    return degrees
+
+def get_float(value, default = -1):
+    return float(value) if len(value) > 0 else default
+
+"""
+Parses a continuous stream of NMEA sentences, as GPS modems output once a second,
+into fixes. Handles RMC (position, speed, course, date and time), GGA (fix quality
+and HDOP) and VTG (speed and course), from any talker ($GP, $GN, ...). Sentences
+that fail their checksum are counted and skipped.
+
+Each parsed sentence publishes a new fix dict in the same format as the AT+CGPSINFO
+reader in graas-bt.py ('lat', 'lon', 'speed' in m/s, 'heading' in degrees, 'timestamp'
+in UTC epoch seconds and 'accuracy' in meters, estimated from HDOP). Values a
+sentence doesn't provide are -1.
+Publishing replaces a single reference, so get_fix() doesn't block or lock.
+
+start() runs the parser on a thread that reads lines from `stream`, e.g. a
+serial.Serial with a timeout so that stop() can take effect.
+"""
+class NmeaReader:
+    def __init__(self, stream = None, max_age = DEFAULT_MAX_AGE):
+        self.stream = stream
+        self.max_age = max_age
+        self.slot = None
+        self.sentences = 0
+        self.checksum_errors = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+        # current state, assembled from the different sentence types
+        self.valid = False
+        self.lat = None
+        self.lon = None
+        self.speed = -1
+        self.heading = -1
+        self.timestamp = -1
+        self.hdop = None
+
+    # parses one sentence, returns True if it updated the current fix
+    def feed(self, line):
+        fields = parse_sentence(line)
+
+        if fields is None:
+            if line.lstrip().startswith('$'):
+                self.checksum_errors += 1
+                logger.debug('nmea: dropping bad sentence %s', line.strip())
+            return False
+
+        self.sentences += 1
+        kind = fields[0][2:]
+
+        try:
+            if kind == 'RMC' and len(fields) >= 10:
+                self.parse_rmc(fields)
+            elif kind == 'GGA' and len(fields) >= 9:
+                self.parse_gga(fields)
+            elif kind == 'VTG' and len(fields) >= 8:
+                self.parse_vtg(fields)
+            else:
+                return False
+        except ValueError:
+            logger.debug('nmea: failed to parse %s', line.strip())
+            return False
+
+        self.publish()
+        return True
+
+    # $GPRMC,<time>,<A/V>,<lat>,<N/S>,<lon>,<E/W>,<knots>,<course>,<date>,...
+    def parse_rmc(self, fields):
+        self.valid = fields[2] == 'A' and len(fields[3]) > 0 and len(fields[5]) > 0
+
+        if not self.valid:
+            return
+
+        self.lat = get_degrees(fields[3], fields[4])
+        self.lon = get_degrees(fields[5], fields[6])
+        self.speed = get_float(fields[7]) * KNOTS_TO_MPS if len(fields[7]) > 0 else -1
+        self.heading = get_float(fields[8])
+
+        t = fields[1]
+        d = fields[9]
+
+        if len(t) >= 6 and len(d) == 6:
+            dt = datetime(2000 + int(d[4:6]), int(d[2:4]), int(d[0:2]), int(t[0:2]), int(t[2:4]), int(t[4:6]), tzinfo = timezone.utc)
+            self.timestamp = int(dt.timestamp())
+
+    # $GPGGA,<time>,<lat>,<N/S>,<lon>,<E/W>,<quality>,<satellites>,<hdop>,...
+    def parse_gga(self, fields):
+        if fields[6] == '' or fields[6] == '0':
+            self.valid = False
+            return
+
+        if len(fields[2]) > 0 and len(fields[4]) > 0:
+            self.lat = get_degrees(fields[2], fields[3])
+            self.lon = get_degrees(fields[4], fields[5])
+
+        self.hdop = get_float(fields[8], None)
+
+    # $GPVTG,<true course>,T,<magnetic course>,M,<knots>,N,<km/h>,K,...
+    def parse_vtg(self, fields):
+        if len(fields[1]) > 0:
+            self.heading = float(fields[1])
+        if len(fields[7]) > 0:
+            self.speed = float(fields[7]) * KMH_TO_MPS
+
+    def publish(self):
+        if not self.valid or self.lat is None:
+            return
+
+        fix = {
+            'lat': self.lat,
+            'lon': self.lon,
+            'speed': self.speed,
+            'heading': self.heading,
+            'timestamp': self.timestamp,
+            'accuracy': -1 if self.hdop is None else round(self.hdop * UERE, 1)
+        }
+
+        self.slot = (time.monotonic(), fix)
+
+    # returns a copy of the latest fix, None if there is none or it is older than max_age seconds
+    def get_fix(self):
+        slot = self.slot
+
+        if slot is None or time.monotonic() - slot[0] > self.max_age:
+            return None
+
+        return dict(slot[1])
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                line = self.stream.readline()
+            except Exception as e:
+                logger.error('nmea: read failed: %s', e)
+                self.stopped.wait(1)
+                continue
+
+            if len(line) > 0:
+                self.feed(line.decode('ascii', errors = 'replace'))
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __str__(self):
+        return f'{{sentences: {self.sentences}, checksum_errors: {self.checksum_errors}, fix: {self.get_fix()}}}'
@@ -0,0 +1,316 @@
+import json
+import log
+import os
+import threading
+import time
+
+SEGMENT_SIZE = 256 * 1024 # bytes
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024 # bytes
+DEFAULT_MAX_AGE = 6 * 60 * 60 # seconds
+FLUSH_COUNT = 16
+FLUSH_INTERVAL = 30 # seconds
+CURSOR_FILE = 'cursor'
+
+logger = log.get_logger('outbox')
+
+"""
+Durable FIFO for signed uploads that couldn't be sent, stored as append-only
+segment files in `folder`. Each line of a segment is one record: creation time,
+endpoint and the signed payload.
+
+Records are buffered in memory and written and fsync'ed in batches, once FLUSH_COUNT
+records or FLUSH_INTERVAL seconds worth have accumulated, to spare the SD card
+a sync per record. A power loss thus loses at most one batch, and a torn last line
+is cut off on startup. The read position is kept in a cursor file that is replaced
+atomically after each drain, so records are delivered at least once: a power loss
+during a drain can resend part of it.
+
+Once segments take up more than `max_size` bytes the oldest segment is deleted.
+Records older than `max_age` seconds are skipped when draining. get_stats() reports
+both, next to queue depth and drain throughput.
+"""
+class Outbox:
+    def __init__(self, folder, max_size = DEFAULT_MAX_SIZE, max_age = DEFAULT_MAX_AGE):
+        self.folder = folder
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.drain_lock = threading.Lock()
+        self.buffer = []
+        self.buffer_time = 0
+        self.depth = 0
+        self.dropped = 0
+        self.expired = 0
+        self.drained = 0
+        self.drain_rate = 0
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.segments = sorted(int(f[:-4]) for f in os.listdir(folder) if f.endswith('.log'))
+        self.read_segment, self.read_offset = self.load_cursor()
+
+        if len(self.segments) == 0:
+            self.segments.append(max(self.read_segment, 0))
+
+        # the cursor may point at a segment deleted after it was written
+        if self.read_segment < self.segments[0]:
+            self.read_segment = self.segments[0]
+            self.read_offset = 0
+
+        self.truncate_torn_line(self.segments[-1])
+
+        for n in self.segments:
+            if n >= self.read_segment:
+                self.depth += self.count_lines(n, self.read_offset if n == self.read_segment else 0)
+
+        logger.info('outbox: %s records pending in %s', self.depth, folder)
+
+    def get_segment_path(self, n):
+        return os.path.join(self.folder, f'{n:08d}.log')
+
+    def get_size(self, n):
+        path = self.get_segment_path(n)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def load_cursor(self):
+        path = os.path.join(self.folder, CURSOR_FILE)
+
+        try:
+            with open(path) as f:
+                tokens = f.read().split()
+                return int(tokens[0]), int(tokens[1])
+        except:
+            return -1, 0
+
+    def save_cursor(self):
+        path = os.path.join(self.folder, CURSOR_FILE)
+        tmp = path + '.tmp'
+
+        with open(tmp, 'w') as f:
+            f.write(f'{self.read_segment} {self.read_offset}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+
+    # cuts off a last line that a power loss left without its newline
+    def truncate_torn_line(self, n):
+        path = self.get_segment_path(n)
+
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb+') as f:
+            data = f.read()
+
+            if len(data) > 0 and data[-1:] != b'\n':
+                end = data.rfind(b'\n') + 1
+                logger.warning('outbox: truncating torn record in %s at %s', path, end)
+                f.truncate(end)
+
+    def count_lines(self, n, offset):
+        path = self.get_segment_path(n)
+
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read().count(b'\n')
+
+    # queues `data` (bytes) for a later post to `endpoint`
+    def put(self, endpoint, data):
+        with self.lock:
+            now = time.time()
+
+            if len(self.buffer) == 0:
+                self.buffer_time = now
+
+            record = {
+                'time': now,
+                'endpoint': endpoint,
+                'data': data.decode('utf-8')
+            }
+
+            self.buffer.append(json.dumps(record, separators=(',', ':')) + '\n')
+            self.depth += 1
+
+            if len(self.buffer) >= FLUSH_COUNT or now - self.buffer_time >= FLUSH_INTERVAL:
+                self.flush_buffer()
+
+    def flush(self):
+        with self.lock:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if len(self.buffer) == 0:
+            return
+
+        n = self.segments[-1]
+
+        if self.get_size(n) >= SEGMENT_SIZE:
+            n += 1
+            self.segments.append(n)
+
+        with open(self.get_segment_path(n), 'ab') as f:
+            f.write(''.join(self.buffer).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+        logger.debug('outbox: flushed %s records to segment %s', len(self.buffer), n)
+        self.buffer = []
+        self.enforce_max_size()
+
+    def enforce_max_size(self):
+        while len(self.segments) > 1 and sum(self.get_size(n) for n in self.segments) > self.max_size:
+            n = self.segments.pop(0)
+
+            if n >= self.read_segment:
+                lost = self.count_lines(n, self.read_offset if n == self.read_segment else 0)
+                self.dropped += lost
+                self.depth -= lost
+                logger.warning('outbox: over %s bytes, dropping %s records', self.max_size, lost)
+
+            os.remove(self.get_segment_path(n))
+
+            if self.read_segment <= n:
+                self.read_segment = self.segments[0]
+                self.read_offset = 0
+                self.save_cursor()
+
+    # returns up to `max_records` lines of the read segment from the read position on
+    def read_lines(self, max_records):
+        path = self.get_segment_path(self.read_segment)
+
+        if not os.path.exists(path):
+            return []
+
+        lines = []
+
+        with open(path, 'rb') as f:
+            f.seek(self.read_offset)
+
+            for line in f:
+                lines.append(line)
+                if len(lines) >= max_records:
+                    break
+
+        return lines
+
+    # moves the read position past `count` records of `size` bytes read from segment:offset
+    def advance(self, segment, offset, count, size):
+        if self.read_segment != segment or self.read_offset != offset:
+            # enforce_max_size() deleted the segment meanwhile and counted its records as dropped
+            self.dropped -= count
+            return
+
+        self.read_offset += size
+        self.depth -= count
+
+    # done with the read segment, moves on unless it is the one being written
+    def next_segment(self):
+        if self.read_segment == self.segments[-1]:
+            return False
+
+        path = self.get_segment_path(self.read_segment)
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.segments.pop(0)
+        self.read_segment = self.segments[0]
+        self.read_offset = 0
+        return True
+
+    """
+    Posts up to `max_records` queued records in order by calling send(endpoint, data),
+    which returns True once a record doesn't need to be sent again. Stops at the first
+    record that send() returns False for. Returns the number of records sent.
+
+    Records are read in batches under the lock, but sent without holding it, so put()
+    doesn't wait for the network while a drain is in progress. Drains don't overlap.
+    """
+    def drain(self, send, max_records):
+        with self.drain_lock:
+            with self.lock:
+                self.flush_buffer()
+
+            start = time.perf_counter()
+            now = time.time()
+            sent = 0
+            expired = 0
+            processed = 0
+            done = False
+
+            while not done and processed < max_records:
+                with self.lock:
+                    segment = self.read_segment
+                    offset = self.read_offset
+                    lines = self.read_lines(max_records - processed)
+
+                    if len(lines) == 0:
+                        if self.next_segment():
+                            continue
+                        break
+
+                count = 0
+                size = 0
+
+                for line in lines:
+                    try:
+                        record = json.loads(line)
+                    except:
+                        record = None
+                        logger.warning('outbox: skipping unreadable record in segment %s', segment)
+
+                    if record is not None and now - record['time'] > self.max_age:
+                        expired += 1
+                        record = None
+
+                    if record is not None:
+                        if not send(record['endpoint'], record['data'].encode('utf-8')):
+                            done = True
+                            break
+                        sent += 1
+
+                    count += 1
+                    size += len(line)
+
+                with self.lock:
+                    self.advance(segment, offset, count, size)
+
+                processed += count
+
+            with self.lock:
+                if processed > 0:
+                    self.save_cursor()
+
+                self.drained += sent
+                self.expired += expired
+                elapsed = time.perf_counter() - start
+
+                if sent > 0:
+                    self.drain_rate = sent / elapsed
+                    logger.info('outbox: drained %s records in %.2f s, %s pending', sent, elapsed, self.depth)
+
+            return sent
+
+    def get_depth(self):
+        with self.lock:
+            return self.depth
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'depth': self.depth,
+                'bytes': sum(self.get_size(n) for n in self.segments),
+                'segments': len(self.segments),
+                'drained': self.drained,
+                'drain_rate': round(self.drain_rate, 1),
+                'dropped': self.dropped,
+                'expired': self.expired
+            }
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,295 @@
+import queue
+import sys
+import threading
+import time
+import traceback
+import log
+
+DEFAULT_INTERVAL = 2 # seconds between GPS samples
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_REPORT_INTERVAL = 60 # seconds
+POLL_TIMEOUT = .5 # seconds
+
+logger = log.get_logger('pipeline')
+
+"""
+Work item for the upload stage. `send` is called without arguments by the upload
+stage, `on_drop` (if given) when the job is dropped from a full upload queue
+without being sent.
+
+Jobs are best effort by default: a dropped job is lost, apart from what its
+`on_drop` does. `durable` jobs must not be lost, they require an `on_drop` that
+keeps their data for a later upload (e.g. in an outbox), and the pipeline counts
+them as spilled rather than dropped.
+"""
+class UploadJob:
+    def __init__(self, name, send, on_drop = None, durable = False):
+        if durable and on_drop is None:
+            raise ValueError(f'durable upload job \'{name}\' needs on_drop')
+
+        self.name = name
+        self.send = send
+        self.on_drop = on_drop
+        self.durable = durable
+        self.created = time.monotonic()
+
+"""
+Bounded queue between two pipeline stages. A full queue drops its oldest item
+rather than blocking the producer, so that a slow consumer always catches up
+with the most recent data. `on_drop` is called with each dropped item.
+"""
+class DropQueue:
+    def __init__(self, name, maxsize, on_drop = None):
+        self.name = name
+        self.queue = queue.Queue(maxsize)
+        self.on_drop = on_drop
+        self.drops = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+            try:
+                dropped = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            logger.warning('%s queue full, dropping oldest item', self.name)
+            self.drop(dropped)
+
+    def drop(self, item):
+        self.drops += 1
+
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    # drops all queued items, e.g. when the consumer has stopped
+    def drop_all(self):
+        while True:
+            try:
+                self.drop(self.queue.get_nowait())
+            except queue.Empty:
+                return
+
+    # returns the next item, or None if there is none within `timeout` seconds
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout = timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self.queue.qsize()
+
+"""
+Counters for how well the pipeline keeps up with its GPS clock. A tick is on time
+if its sample started within half an interval of its scheduled time. Ticks that
+had to be skipped because a previous sample overran count as missed.
+"""
+class CadenceStats:
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.ticks = 0
+        self.on_time = 0
+        self.skipped = 0
+        self.fixes = 0
+        self.max_lateness = 0
+        self.inferences = 0
+        self.inference_seconds = 0
+        self.uploads = 0
+        self.upload_failures = 0
+        self.upload_latency = 0
+        self.max_upload_latency = 0
+
+    def record_tick(self, lateness, fix):
+        with self.lock:
+            self.ticks += 1
+            if lateness <= self.interval / 2:
+                self.on_time += 1
+            if fix is not None:
+                self.fixes += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+
+    def record_skipped(self, count):
+        with self.lock:
+            self.skipped += count
+
+    def record_inference(self, seconds):
+        with self.lock:
+            self.inferences += 1
+            self.inference_seconds += seconds
+
+    def record_upload(self, latency, ok):
+        with self.lock:
+            self.uploads += 1
+            if not ok:
+                self.upload_failures += 1
+            self.upload_latency += latency
+            self.max_upload_latency = max(self.max_upload_latency, latency)
+
+    # returns the fraction of scheduled ticks that were sampled on time
+    def get_cadence(self):
+        with self.lock:
+            scheduled = self.ticks + self.skipped
+            return self.on_time / scheduled if scheduled > 0 else 1
+
+    def __str__(self):
+        cadence = self.get_cadence()
+
+        with self.lock:
+            inference_ms = 1000 * self.inference_seconds / max(self.inferences, 1)
+            upload_latency = self.upload_latency / max(self.uploads, 1)
+
+            return (f'{{cadence: {100 * cadence:.1f}% ({self.on_time}/{self.ticks + self.skipped} on time at {self.interval}s), '
+                + f'skipped: {self.skipped}, fixes: {self.fixes}, max_lateness: {self.max_lateness:.2f}s, '
+                + f'inference: {inference_ms:.1f}ms avg, uploads: {self.uploads} ({self.upload_failures} failed), '
+                + f'upload_latency: {upload_latency:.2f}s avg, {self.max_upload_latency:.2f}s max}}')
+
+"""
+Runs the device main loop as three stages on their own threads, connected by
+bounded queues:
+
+- GPS: calls read_gps() on a fixed clock of `interval` seconds and queues the
+  result (a fix, or None if there was none)
+- inference: calls infer(fix) for each queued fix, which returns a list of
+  UploadJobs
+- upload: sends queued jobs in order
+
+A slow network thus delays uploads, but neither GPS sampling nor inference.
+When a stage falls behind, its input queue drops the oldest items; durable
+upload jobs are spilled through their on_drop instead of being lost, as are
+those still queued when the pipeline stops. Exceptions
+in a stage callback are logged and the stage continues with the next item.
+"""
+class Pipeline:
+    def __init__(self, read_gps, infer, interval = DEFAULT_INTERVAL, queue_size = DEFAULT_QUEUE_SIZE):
+        self.read_gps = read_gps
+        self.infer = infer
+        self.interval = interval
+        self.stats = CadenceStats(interval)
+        self.fix_queue = DropQueue('fix', queue_size)
+        self.upload_queue = DropQueue('upload', queue_size, self.drop_job)
+        self.spilled = 0
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def drop_job(self, job):
+        if job.durable:
+            self.spilled += 1
+
+        if job.on_drop is not None:
+            try:
+                job.on_drop()
+            except:
+                logger.error('dropping %s: %s', job.name, sys.exc_info()[0])
+                traceback.print_exc()
+
+    def run_gps(self):
+        next_tick = time.monotonic()
+
+        while not self.stopped.is_set():
+            delay = next_tick - time.monotonic()
+
+            if delay > 0 and self.stopped.wait(delay):
+                break
+
+            lateness = time.monotonic() - next_tick
+            fix = None
+
+            try:
+                fix = self.read_gps()
+            except:
+                logger.error('gps stage: %s', sys.exc_info()[0])
+                traceback.print_exc()
+
+            self.stats.record_tick(lateness, fix)
+            # wrapped, as a None fix is a valid item
+            self.fix_queue.put((fix,))
+
+            next_tick += self.interval
+            now = time.monotonic()
+
+            # don't try to catch up on ticks a slow read has overrun
+            if now > next_tick:
+                skipped = int((now - next_tick) / self.interval) + 1
+                self.stats.record_skipped(skipped)
+                next_tick += skipped * self.interval
+
+    def run_inference(self):
+        while not self.stopped.is_set():
+            item = self.fix_queue.get(POLL_TIMEOUT)
+
+            if item is None:
+                continue
+
+            fix = item[0]
+            start = time.monotonic()
+
+            try:
+                jobs = self.infer(fix)
+            except:
+                logger.error('inference stage: %s', sys.exc_info()[0])
+                traceback.print_exc()
+                jobs = []
+
+            self.stats.record_inference(time.monotonic() - start)
+
+            for job in jobs:
+                self.upload_queue.put(job)
+
+    def run_upload(self):
+        while not self.stopped.is_set():
+            job = self.upload_queue.get(POLL_TIMEOUT)
+
+            if job is None:
+                continue
+
+            ok = True
+
+            try:
+                job.send()
+            except:
+                logger.error('upload stage, %s: %s', job.name, sys.exc_info()[0])
+                traceback.print_exc()
+                ok = False
+
+            self.stats.record_upload(time.monotonic() - job.created, ok)
+
+    def start(self):
+        for target in [self.run_gps, self.run_inference, self.run_upload]:
+            t = threading.Thread(target = target, daemon = True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.stopped.set()
+
+        for t in self.threads:
+            t.join()
+
+        self.threads = []
+
+        # jobs that won't be sent any more, spill durable ones
+        self.upload_queue.drop_all()
+
+    def get_report(self):
+        return f'pipeline: {self.stats}, queued: {self.fix_queue.qsize()} fixes, {self.upload_queue.qsize()} uploads, dropped: {self.fix_queue.drops} fixes, {self.upload_queue.drops - self.spilled} uploads, spilled: {self.spilled} uploads'
+
+    # starts the stages and logs a report every `report_interval` seconds until interrupted,
+    # `report` optionally returns more to log with it
+    def run(self, report_interval = DEFAULT_REPORT_INTERVAL, report = None):
+        self.start()
+
+        try:
+            while not self.stopped.wait(report_interval):
+                logger.info('%s', self.get_report())
+                if report is not None:
+                    logger.info('%s', report())
+        finally:
+            self.stop()
+            logger.info('%s', self.get_report())
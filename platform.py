@@ -4,12 +4,18 @@ Abstraction layer for platform dependencies, useful e.g. for porting.
 To port this to e.g. client-side JS, files could be replaced by localStorage
 blobs.
 """
+import csv
 import os
+import pickle
+import shutil
 from zipfile import ZipFile
 
 def get_text_file_contents(path):
     return open(path)
 
+def get_binary_file_contents(path):
+    return open(path, 'rb')
+
 def read_file(path):
     #print('read_file()')
     #print(f'- path: {path}')
@@ -21,12 +27,38 @@ def write_to_file(path, content):
         f.write(content)
         f.close()
 
+def write_object(path, obj):
+    # write to a temp file first so that a power loss mid-write
+    # never leaves a truncated object behind
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+def read_object(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
 def get_mtime(path):
     return os.path.getmtime(path)
 
 def resource_exists(path):
     return os.path.exists(path)
 
+def remove_resource(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def list_resources(path, prefix = ''):
+    if not os.path.isdir(path):
+        return []
+
+    return [n for n in os.listdir(path) if n.startswith(prefix)]
+
 def ensure_resource_path(path):
     if not os.path.isdir(path):
         os.makedirs(path)
@@ -40,14 +72,55 @@ def unpack_zip(url, dst_path, files):
     #print(f'- dst_path: {dst_path}')
     #print(f'- files: {files}')
 
-    gtfs_zip = ZipFile(url)
+    with ZipFile(url) as gtfs_zip:
+        for n in files:
+            #print(f'-- zip entry: {n}')
+            #print(f'++ name: {dst_path + n}')
+            tmp_path = dst_path + n + '.tmp'
+
+            with gtfs_zip.open(n) as ze, open(tmp_path, 'wb') as ff:
+                # copy raw bytes in chunks so that file offsets into the
+                # unpacked copy match offsets reported by read_zip_table()
+                shutil.copyfileobj(ze, ff)
+
+            # replace rather than overwrite, existing memory maps
+            # of the old file stay valid
+            os.replace(tmp_path, dst_path + n)
+
+def zip_entry_exists(zip_path, name):
+    with ZipFile(zip_path) as z:
+        return name in z.namelist()
+
+def read_zip_table(zip_path, name, with_offsets = False, columns = None):
+    """
+    Generator that streams the rows of CSV table `name` straight out of archive `zip_path`,
+    one line at a time, without unpacking the entry to disk or into memory. Rows are dicts
+    keyed by column name, restricted to `columns` if given. If `with_offsets` is True,
+    (offset, row) tuples are yielded instead, with offset being the byte offset of the
+    row in the uncompressed entry.
+    """
+    with ZipFile(zip_path) as z, z.open(name) as ze:
+        header = ze.readline()
+        offset = len(header)
+        header = header.decode('utf-8')
+
+        # utf-8 BOM
+        if header.startswith('\ufeff'):
+            header = header[1:]
+
+        csvline = csv.CSVLine(header.strip(), columns)
+
+        for line in ze:
+            line_offset = offset
+            offset += len(line)
+
+            line = line.decode('utf-8').strip()
+            if len(line) == 0:
+                continue
 
-    for n in files:
-        #print(f'-- zip entry: {n}')
-        ze = gtfs_zip.open(n)
-        content = ze.read().decode('utf-8')
+            r = csvline.parse(line)
 
-        #print(f'++ name: {dst_path + n}')
-        with open(dst_path + n, 'w') as ff:
-            ff.write(content)
-            ff.close()
+            if with_offsets:
+                yield line_offset, r
+            else:
+                yield r
@@ -0,0 +1,39 @@
+import time
+
+"""
+Collects positions for a batched upload, for sending them in one signed request
+rather than one request each. A batch is due once it holds `max_count` positions,
+its first position is `max_age` seconds old, or the trip id changed, so that the
+server learns about a new trip without delay. Positions are dicts with at least
+a 'trip-id' key.
+"""
+class PositionBatch:
+    def __init__(self, max_count, max_age):
+        self.max_count = max_count
+        self.max_age = max_age
+        self.positions = []
+        self.start_time = 0
+        self.trip_id = None
+
+    # adds `position`, returns True if the batch should be sent now
+    def add(self, position, now = None):
+        if now is None:
+            now = time.monotonic()
+
+        if len(self.positions) == 0:
+            self.start_time = now
+
+        self.positions.append(position)
+        trip_changed = position['trip-id'] != self.trip_id
+        self.trip_id = position['trip-id']
+
+        return trip_changed or len(self.positions) >= self.max_count or now - self.start_time >= self.max_age
+
+    # returns the positions collected so far and starts a new batch
+    def take(self):
+        positions = self.positions
+        self.positions = []
+        return positions
+
+    def __len__(self):
+        return len(self.positions)
@@ -0,0 +1,156 @@
+"""
+Checks accuracy and per-update cost of point-to-polyline distances computed
+from way points projected once into feet (geo_util.Projection centered on the
+agency area) against haversine based distances, for shapes of a GTFS archive:
+
+    python projection-check.py ~/tmp/gtfs-cache/gtfs.zip [<samples>]
+"""
+
+import geo_util
+import math
+import platform
+import random
+import sys
+import time
+import util
+from area import Area
+
+WINDOW_SIZE = 30 # way points per segment
+MAX_OFFSET = 3000 # feet
+SEARCH_STEPS = 60
+
+def load_shapes(zip_path):
+    shapes = {}
+
+    for r in platform.read_zip_table(zip_path, 'shapes.txt', False, ['shape_id', 'shape_pt_lat', 'shape_pt_lon']):
+        shape = shapes.get(r['shape_id'], None)
+
+        if shape is None:
+            shape = ([], [])
+            shapes[r['shape_id']] = shape
+
+        shape[0].append(float(r['shape_pt_lat']))
+        shape[1].append(float(r['shape_pt_lon']))
+
+    return shapes
+
+# reference distance: golden section search for the closest point on each leg, using haversine only
+def get_haversine_polyline_distance(latu, lonu, lats, lons):
+    min_distance = float('inf')
+    g = (math.sqrt(5) - 1) / 2
+
+    for i in range(max(len(lats) - 1, 1)):
+        j = min(i + 1, len(lats) - 1)
+        f = lambda t: util.haversine_distance(lats[i] + t * (lats[j] - lats[i]), lons[i] + t * (lons[j] - lons[i]), latu, lonu)
+        a = 0
+        b = 1
+
+        for k in range(SEARCH_STEPS):
+            c = b - g * (b - a)
+            d = a + g * (b - a)
+            if f(c) < f(d):
+                b = d
+            else:
+                a = c
+
+        min_distance = min(min_distance, f(0), f(1), f((a + b) / 2))
+
+    return min_distance
+
+def get_legacy_distance(latu, lonu, lats, lons):
+    min_distance = float('inf')
+
+    for i in range(len(lats) - 1):
+        sp1 = {'lat': lats[i], 'lon': lons[i]}
+        sp2 = {'lat': lats[i + 1], 'lon': lons[i + 1]}
+        min_distance = min(min_distance, geo_util.get_min_distance(sp1, sp2, latu, lonu, 0))
+
+    return min_distance
+
+def get_samples(shapes, count):
+    samples = []
+    ids = list(shapes)
+
+    while len(samples) < count:
+        lats, lons = shapes[random.choice(ids)]
+
+        if len(lats) < 2:
+            continue
+
+        i = random.randint(0, max(len(lats) - WINDOW_SIZE, 0))
+        wlats = lats[i:i + WINDOW_SIZE]
+        wlons = lons[i:i + WINDOW_SIZE]
+        k = random.randint(0, len(wlats) - 1)
+        latu = wlats[k] + util.get_feet_as_lat_degrees(random.uniform(-MAX_OFFSET, MAX_OFFSET))
+        lonu = wlons[k] + util.get_feet_as_long_degrees(random.uniform(-MAX_OFFSET, MAX_OFFSET))
+        samples.append((latu, lonu, wlats, wlons))
+
+    return samples
+
+def run(fn, samples, min_seconds = .5):
+    count = 0
+    start = time.perf_counter()
+
+    while True:
+        for s in samples:
+            fn(s)
+        count += len(samples)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+
+    return elapsed / count * 1000000
+
+def main(zip_path, sample_count):
+    shapes = load_shapes(zip_path)
+    area = Area()
+
+    for id in shapes:
+        for lat, lon in zip(*shapes[id]):
+            area.update(lat, lon)
+
+    projection = geo_util.Projection.for_area(area)
+    print(f'- area: {area}')
+    print(f'- projection: {projection}')
+
+    samples = get_samples(shapes, sample_count)
+
+    # way points are projected once at load, only the update is projected per call
+    precomputed = []
+    for latu, lonu, lats, lons in samples:
+        xs, ys = projection.project(lats, lons)
+        precomputed.append((latu, lonu, xs, ys))
+
+    def get_precomputed_distance(latu, lonu, xs, ys):
+        x, y = projection.get_xy(latu, lonu)
+        return geo_util.get_min_planar_distance(x, y, xs, ys)[0]
+
+    methods = [
+        ('legacy get_min_distance', lambda s: get_legacy_distance(*s), samples),
+        ('projection around update', lambda s: geo_util.get_min_polyline_distance(*s)[0], samples),
+        ('precomputed projection', lambda s: get_precomputed_distance(*s), precomputed)
+    ]
+
+    reference = [get_haversine_polyline_distance(*s) for s in samples]
+
+    print(f'{"method":<26} {"max error":>11} {"mean error":>11} {"max rel":>9} {"us/update":>10}')
+
+    for name, fn, inputs in methods:
+        errors = [abs(fn(inputs[i]) - reference[i]) for i in range(len(inputs))]
+        rel = max(errors[i] / max(reference[i], 1) for i in range(len(inputs)))
+        t = run(fn, inputs)
+
+        print(f'{name:<26} {max(errors):>8.2f} ft {sum(errors) / len(errors):>8.2f} ft {100 * rel:>8.3f}% {t:>10.1f}')
+
+    print(f'(errors against haversine distances, {len(samples)} updates within {MAX_OFFSET} ft of {WINDOW_SIZE} point segments)')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} <gtfs-zip> [<samples>]')
+        exit(1)
+
+    sample_count = 500
+    if len(sys.argv) > 2:
+        sample_count = int(sys.argv[2])
+
+    main(sys.argv[1], sample_count)
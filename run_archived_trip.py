@@ -1,4 +1,5 @@
 import inference
+import log
 import os
 import sys
 import time
@@ -34,7 +35,10 @@ def main(data_files, cache_folder, output_folder, static_gtfs_url, simulate_bloc
     tee = Tee()
     stdout_save = sys.stdout
     sys.stdout = tee
-    last_dow = -1
+
+    # analysis tools parse result lines from the per-file logs
+    result_sink_save = (log.result_sink, log.result_events)
+    log.set_result_sink(log.plain_sink, [log.TRIP_ID, log.SEGMENT_UPDATE])
     inf = None
 
     for df in data_files:
@@ -55,10 +59,10 @@ def main(data_files, cache_folder, output_folder, static_gtfs_url, simulate_bloc
         name = m1.group(1)
 
         m2 = re.search(pattern2, df)
-        dow = get_dow(m2.group(1))
-        epoch_seconds = util.get_epoch_seconds(m2.group(1))
+        date = get_date(m2.group(1))
 
-        if dow != last_dow:
+        # a single model serves all service dates
+        if inf is None:
             tee.redirect()
 
             agency_id = get_agency_id_from_path(df)
@@ -68,13 +72,9 @@ def main(data_files, cache_folder, output_folder, static_gtfs_url, simulate_bloc
                 cache_folder,
                 static_gtfs_url,
                 agency_id,
-                'test-vehicle-id',
-                15,
-                dow,
-                epoch_seconds
+                'test-vehicle-id'
             )
 
-        last_dow = dow
         inf.reset_scoring()
 
         fn = output_folder + '/' + m1.group(1) + '-log.txt'
@@ -94,7 +94,7 @@ def main(data_files, cache_folder, output_folder, static_gtfs_url, simulate_bloc
                 grid_index = inf.grid.get_index(lat, lon)
                 util.debug(f'current location: lat={lat} long={lon} seconds={day_seconds} grid_index={grid_index}')
 
-                result = inf.get_trip_id(lat, lon, day_seconds, expected_trip_id)
+                result = inf.get_trip_id(lat, lon, day_seconds, expected_trip_id, date)
                 print(f'- result: {result}')
 
                 trip_id = None
@@ -102,19 +102,19 @@ def main(data_files, cache_folder, output_folder, static_gtfs_url, simulate_bloc
                 if result is not None:
                     trip_id = result.get('trip_id', None)
 
-                print(f'- trip_id: {trip_id}')
+                log.result(log.TRIP_ID, {'trip_id': trip_id})
 
+    log.set_result_sink(*result_sink_save)
     sys.stdout = stdout_save
 
 
 # assumes that filename contains a string of format yyyy-mm-dd
-# returns day of week: 0-6 for Monday through Sunday if date string present, -1 otherwise
-def get_dow(yyyymmdd):
+# returns the date if date string present, None otherwise
+def get_date(yyyymmdd):
     if yyyymmdd:
-        date = datetime.strptime(yyyymmdd, '%Y-%m-%d')
-        return date.weekday()
+        return datetime.strptime(yyyymmdd, '%Y-%m-%d').date()
     else:
-        return -1
+        return None
 
 def usage():
     print(f'usage: {sys.argv[0]} -o|--output-folder <output-folder> -c|--cache-foler <cache-folder> -u|--static-gtfs-url <static-gtfs-url> data-file [<data-files>]')
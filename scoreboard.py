@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import heapq
+import math
+
+DEFAULT_HALF_LIFE = 5 * 60 # seconds
+DEFAULT_MAX_IDLE = 15 * 60 # seconds
+DEFAULT_MAX_SIZE = 256
+COMPACT_MIN = 64
+
+"""
+Trip candidate scores that decay over time, with O(log n) access to the leader.
+
+A score s added at time t counts as s * 2^(-(now - t) / half_life). Since all
+candidates decay at the same rate, their order never changes between updates,
+so each candidate keeps its score scaled to time 0 instead: the sum of
+s * e^(rate * t), kept in the log domain so it can't overflow over a long shift.
+Leader lookup is a max heap over these values. Every update pushes a new heap
+entry, entries that no longer match their candidate's version are dropped when
+they reach the top, and the heap gets rebuilt once dead entries dominate.
+
+Candidates are kept in least recently updated order. Those without an update
+for more than `max_idle` seconds are evicted, and if there are more than
+`max_size`, the least recently updated ones go first.
+"""
+class Scoreboard:
+    def __init__(self, half_life = DEFAULT_HALF_LIFE, max_idle = DEFAULT_MAX_IDLE, max_size = DEFAULT_MAX_SIZE):
+        self.rate = math.log(2) / half_life
+        self.max_idle = max_idle
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self.candidates = OrderedDict()
+        self.heap = []
+        self.version = 0
+        self.now = None
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def __contains__(self, trip_id):
+        return trip_id in self.candidates
+
+    # moves the scoreboard clock to `seconds` and evicts stale candidates. A clock
+    # going back by more than max_idle (e.g. day seconds wrapping at midnight, or a
+    # new replay) starts over, smaller steps back are treated as jitter
+    def advance(self, seconds):
+        if self.now is not None and seconds < self.now - self.max_idle:
+            self.clear()
+
+        if self.now is None or seconds > self.now:
+            self.now = seconds
+
+        while len(self.candidates) > 0:
+            trip_id, cand = next(iter(self.candidates.items()))
+
+            if cand['last_update'] >= self.now - self.max_idle:
+                break
+
+            self.candidates.popitem(last = False)
+
+    # adds `score` to trip_id at the current clock time
+    def add(self, trip_id, score, name, time_offset):
+        log_value = math.log(score) + self.rate * self.now
+        cand = self.candidates.get(trip_id, None)
+
+        if cand is None:
+            cand = {'log_value': log_value, 'name': name}
+            self.candidates[trip_id] = cand
+        else:
+            cand['log_value'] = log_add(cand['log_value'], log_value)
+            self.candidates.move_to_end(trip_id)
+
+        self.version += 1
+        cand['time_offset'] = time_offset
+        cand['last_update'] = self.now
+        cand['version'] = self.version
+        heapq.heappush(self.heap, (-cand['log_value'], self.version, trip_id))
+
+        if len(self.candidates) > self.max_size:
+            self.candidates.popitem(last = False)
+
+        if len(self.heap) > 2 * len(self.candidates) + COMPACT_MIN:
+            self.compact()
+
+    def compact(self):
+        self.heap = [(-c['log_value'], c['version'], id) for id, c in self.candidates.items()]
+        heapq.heapify(self.heap)
+
+    # returns the decayed score of candidate `cand` at the current clock time
+    def get_score(self, cand):
+        return math.exp(cand['log_value'] - self.rate * self.now)
+
+    # returns (trip_id, candidate) with the highest score, or (None, None) if empty
+    def get_leader(self):
+        while len(self.heap) > 0:
+            neg_value, version, trip_id = self.heap[0]
+            cand = self.candidates.get(trip_id, None)
+
+            if cand is not None and cand['version'] == version:
+                return trip_id, cand
+
+            heapq.heappop(self.heap)
+
+        return None, None
+
+    def items(self):
+        return self.candidates.items()
+
+def log_add(a, b):
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
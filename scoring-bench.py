@@ -0,0 +1,117 @@
+"""
+Compares get_trip_id() segment scoring latency of scoring each segment for
+each of its trips against the batched path (SegmentBatch candidate selection
+followed by segment.get_scores(), which computes distances once per segment
+and then only checks the time of each trip), on the busiest grid cells of a
+feed, e.g.:
+
+    python scoring-bench.py ~/tmp/gtfs-cache ~/tmp/gtfs-cache/gtfs.zip [<cells>]
+
+Results of both paths are checked against each other.
+"""
+
+import inference
+import log
+import math
+import random
+import segment
+import sys
+import time
+import util
+
+UPDATES_PER_CELL = 50
+
+def get_updates(segment_list):
+    updates = []
+
+    for i in range(UPDATES_PER_CELL):
+        s = random.choice(segment_list)
+        p = util.get_random_point(s.bounding_box)
+        start_time, end_time = s.get_times(random.choice(s.trips))
+        seconds = util.get_random_int(start_time, end_time)
+        updates.append((p.lat, p.lon, seconds))
+
+    return updates
+
+# both return a dict of (segment ID, trip ID) to result for all segments and trips that can score
+def per_segment(segment_list, lat, lon, seconds, path):
+    results = {}
+
+    for s in segment_list:
+        for trip in s.trips:
+            r = s.get_score(trip, lat, lon, seconds, path)
+            if r['score'] > 0:
+                results[(s.id, trip.id)] = r
+
+    return results
+
+def batched(batch, lat, lon, seconds, path):
+    candidate_list = batch.get_candidates(lat, lon, seconds)
+    results = {}
+
+    for s, trip, r in segment.get_scores(candidate_list, lat, lon, seconds, path):
+        if r['score'] > 0:
+            results[(s.id, trip.id)] = r
+
+    return results
+
+def run(fn, segments, updates, path):
+    results = []
+    start = time.perf_counter()
+
+    for lat, lon, seconds in updates:
+        results.append(fn(segments, lat, lon, seconds, path))
+
+    return (time.perf_counter() - start) / len(updates) * 1000, results
+
+def main(cache_folder, url, cell_count):
+    inf = inference.TripInference(cache_folder, url, 'test-agency-id', 'test-vehicle-id')
+    path = inf.path
+    table = inf.grid.table
+    keys = sorted(table, key = lambda k: len(table[k]), reverse = True)[:cell_count]
+
+    print(f'{"cell":>6} {"segments":>9} {"trips":>7} {"in window":>10} {"per segment":>12} {"batched":>10} {"speedup":>8}')
+
+    for key in keys:
+        segment_list = table[key]
+        batch = segment.SegmentBatch(segment_list)
+        updates = get_updates(segment_list)
+
+        # warm up the way point cache, so that both paths only measure scoring
+        run(per_segment, segment_list, updates, path)
+
+        t1, r1 = run(per_segment, segment_list, updates, path)
+        t2, r2 = run(batched, batch, updates, path)
+
+        for a, b in zip(r1, r2):
+            assert a.keys() == b.keys(), f'{a.keys()} != {b.keys()}'
+            for id in a:
+                x = a[id]
+                y = b[id]
+                assert math.isclose(x['score'], y['score'], abs_tol = 1e-9) and x['time_offset'] == y['time_offset'], f'{x} != {y}'
+
+        # segments the batched path looks at after bisecting the time interval index
+        in_window = 0
+        for lat, lon, seconds in updates:
+            lo, hi = batch.get_time_range(seconds)
+            in_window += hi - lo
+
+        trip_count = sum(len(s.trips) for s in segment_list)
+        print(f'{key:>6} {len(segment_list):>9} {trip_count:>7} {in_window / len(updates):>10.1f} {t1:>12.3f} {t2:>10.3f} {t1 / t2:>7.1f}x')
+
+    print('(times in milliseconds per update, trips counts trips over all segments of the cell, in window is the average number of segments per update in the time range checked)')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'usage: {sys.argv[0]} <cache-folder> <static-gtfs-url> [<cells>]')
+        exit(1)
+
+    cell_count = 5
+    if len(sys.argv) > 3:
+        cell_count = int(sys.argv[3])
+
+    # keep log output and result events out of the measurements
+    log.set_level(log.WARNING)
+    log.set_result_sink(log.plain_sink, [])
+
+    main(sys.argv[1], sys.argv[2], cell_count)
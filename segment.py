@@ -1,42 +1,160 @@
 from area import Area
+from shapepoint import ShapePoint
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 import csv
-import random
+import mmap
+import platform
 import geo_util
+import log
 import util
 
 MAX_LOCATION_DISTANCE = 30000 # feet
 MAX_TIME_DISTANCE = 900 # seconds
+WAYPOINT_CACHE_SIZE = 2048 # entries
+
+logger = log.get_logger('segment')
 
 """
-### TODO add cache for way points with predicted arrival times:
-    - key: hash of min_file_offset, max_file_offset, start_time and end_time
-    - value: grid index, list of way points with predicted arrival times
-    - add class method set_current_grid_index(), which will flush all
-      cache entries with non-matching grid index
-    - in get_score(), either get way points from cache or create and
-      put into cache
+Shared cache for segment way points.
+
+Way points are parsed on demand from a single memory-mapped copy of shapes.txt,
+using the byte offset range of a segment. Segments belong to a shape rather than
+to a trip, so one entry serves all trips running over a segment. The least
+recently used entry is evicted once more than `capacity` entries are held.
+"""
+class WaypointCache:
+    def __init__(self, capacity = WAYPOINT_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.path = None
+        self.file = None
+        self.map = None
+        self.csvline = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open(self, path):
+        self.close()
+
+        self.path = path
+        self.file = platform.get_binary_file_contents(path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = self.map.readline().decode('utf-8')
+
+        # utf-8 BOM
+        if header.startswith('\ufeff'):
+            header = header[1:]
+
+        self.csvline = csv.CSVLine(header.strip(), ['shape_pt_lat', 'shape_pt_lon'])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+
+        self.path = None
+        self.file = None
+        self.map = None
+        self.entries.clear()
+
+    # returns (lats, lons, xs, ys) arrays for segment `s`, with xs/ys in s.projection
+    def get(self, s):
+        key = (s.min_file_offset, s.max_file_offset)
+        entry = self.entries.get(key, None)
+
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = self.load(s)
+        self.entries[key] = entry
+
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return entry
+
+    def load(self, s):
+        lats = array('d')
+        lons = array('d')
+
+        # include the line starting at max_file_offset
+        end = self.map.find(b'\n', s.max_file_offset)
+        if end < 0:
+            end = len(self.map)
+
+        for line in self.map[s.min_file_offset:end].decode('utf-8').splitlines():
+            r = self.csvline.parse(line.strip())
+            lats.append(float(r['shape_pt_lat']))
+            lons.append(float(r['shape_pt_lon']))
+
+        xs, ys = s.projection.project(lats, lons)
+        return (lats, lons, xs, ys)
+
+    def __str__(self):
+        return f'{{entries: {len(self.entries)}, hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}}}'
+
+"""
+A stretch of a shape, from way point `first_point` to `last_point`, shared by all
+trips running over that shape. Feeds can have hundreds of thousands of segments,
+so they use __slots__ and keep their bounding box as four floats. self.trips holds those trips sorted by the start of
+their time window on the segment, see get_time_window(), so that get_trips() can
+find the ones covering a given time by bisection, the same way SegmentBatch does
+for segments. index_trips() needs to be called once all trips are added.
 """
 class Segment:
+    __slots__ = (
+        'id', 'segment_index', 'segments_per_trip', 'shape_id', 'projection',
+        'min_lat', 'max_lat', 'min_lon', 'max_lon',
+        'first_point', 'last_point', 'min_file_offset', 'max_file_offset',
+        'trips', 'window', 'window_starts', 'window_ends', 'max_window'
+    )
+
     id_base = 0
+    waypoint_cache = WaypointCache()
 
-    def __init__(self, segment_index, trip_id, trip_name, trip_start_seconds, stop_id, bounding_box, start_time, end_time, min_file_offset, max_file_offset):
+    def __init__(self, segment_index, shape_id, min_lat, max_lat, min_lon, max_lon, first_point, last_point, min_file_offset, max_file_offset, projection):
         self.id = Segment.id_base
         Segment.id_base += 1
 
-        util.debug(f'segment: id={self.id} trip_id={trip_id} top_left={bounding_box.top_left} bottom_right={bounding_box.bottom_right} start_time={util.seconds_to_hhmmss(start_time)} end_time={util.seconds_to_hhmmss(end_time)}')
+        logger.debug('segment: id=%s shape_id=%s lat=%s..%s lon=%s..%s', self.id, shape_id, min_lat, max_lat, min_lon, max_lon)
 
         self.segment_index = segment_index
-        self.trip_id = trip_id
-        self.trip_name = trip_name
-        self.trip_start_seconds = trip_start_seconds
-        self.stop_id = stop_id
-        #print(f'- trip_start_seconds: {trip_start_seconds}')
-        self.bounding_box = bounding_box
-        self.start_time = start_time
-        self.end_time = end_time
+        self.segments_per_trip = 0
+        self.shape_id = shape_id
+        self.projection = projection
+        self.min_lat = min_lat
+        self.max_lat = max_lat
+        self.min_lon = min_lon
+        self.max_lon = max_lon
+        self.first_point = first_point
+        self.last_point = last_point
         self.min_file_offset = min_file_offset
         self.max_file_offset = max_file_offset
-        self.waypoint_list = None
+        self.trips = []
+        self.window = (0, -1)
+        self.window_starts = array('l')
+        self.window_ends = array('l')
+        self.max_window = 0
+
+    # returns an Area for the segment's bounding box, for callers that need one
+    @property
+    def bounding_box(self):
+        return Area(ShapePoint(self.max_lat, self.min_lon), ShapePoint(self.min_lat, self.max_lon))
+
+    # returns (min_lat, max_lat, min_lon, max_lon)
+    def get_bounds(self):
+        return (self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+
+    def contains(self, lat, lon):
+        return self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon
 
     def set_segments_per_trip(self, count):
         self.segments_per_trip = count
@@ -44,71 +162,98 @@ class Segment:
     def get_trip_fraction(self):
         return float(self.segment_index) / self.segments_per_trip
 
-    def get_score(self, lat, lon, seconds, path):
-        if not self.bounding_box.contains(lat, lon):
-            return {'score': -1, 'time_offset': 0}
+    def add_trip(self, trip):
+        self.trips.append(trip)
 
-        ### REMOVE ME: for testing only
-        #if random.random() < .5:
-        #    util.debug(f'segment update: id={self.id} trip-name={util.to_b64(self.trip_name)} score={0.0000001}')
+    def index_trips(self):
+        windows = [self.get_time_window(t) for t in self.trips]
+        order = sorted(range(len(self.trips)), key = lambda i: windows[i][0])
 
-        if seconds < self.trip_start_seconds or seconds < self.start_time - MAX_TIME_DISTANCE or seconds > self.end_time + MAX_TIME_DISTANCE:
-            return {'score': -1, 'time_offset': 0}
+        self.trips = [self.trips[i] for i in order]
+        self.window_starts = array('l', [windows[i][0] for i in order])
+        self.window_ends = array('l', [windows[i][1] for i in order])
+        self.max_window = max([e - s for s, e in windows], default = 0)
+
+        if len(windows) > 0:
+            self.window = (self.window_starts[0], max(self.window_ends))
+
+    # returns (start, end) of the segment's time span for `trip`
+    def get_times(self, trip):
+        return trip.get_segment_times(self.segment_index - 1)
+
+    # returns (start, end) of the time span in which `trip` can score on the segment,
+    # or that of any of its trips if `trip` is None
+    def get_time_window(self, trip = None):
+        if trip is None:
+            return self.window
 
-        if self.waypoint_list is None:
-            self.waypoint_list = []
+        start_time, end_time = self.get_times(trip)
+        return (max(trip.start_seconds, start_time - MAX_TIME_DISTANCE), end_time + MAX_TIME_DISTANCE)
 
-            with open(path + '/shapes.txt', 'r') as f:
-                names = f.readline().strip()
-                csvline = csv.CSVLine(names)
+    # returns trips with a time window covering `seconds`, optionally limited to
+    # services in `active_services` and trip IDs in `trip_ids`
+    def get_trips(self, seconds, active_services = None, trip_ids = None):
+        lo = bisect_left(self.window_starts, seconds - self.max_window)
+        hi = bisect_right(self.window_starts, seconds, lo)
+        result = []
 
-                f.seek(self.min_file_offset)
+        for i in range(lo, hi):
+            if self.window_ends[i] < seconds:
+                continue
 
-                while True:
-                    line = f.readline().strip()
-                    r = csvline.parse(line)
+            trip = self.trips[i]
 
-                    llat = float(r['shape_pt_lat'])
-                    llon = float(r['shape_pt_lon'])
+            if active_services is not None and not trip.service_id in active_services:
+                continue
 
-                    self.waypoint_list.append({'lat': llat, 'lon': llon})
+            if trip_ids is not None and not trip.id in trip_ids:
+                continue
 
-                    if f.tell() > self.max_file_offset:
-                        break
+            result.append(trip)
 
-            delta_time = self.end_time - self.start_time
+        return result
 
-            for i in range(len(self.waypoint_list)):
-                fraction = i / len(self.waypoint_list)
-                time = int(self.start_time + fraction * delta_time)
-                self.waypoint_list[i]['time'] = time
+    # returns (lats, lons, xs, ys) arrays of the segment's way points
+    def get_way_points(self, path):
+        cache = Segment.waypoint_cache
+        shapes_path = path + '/shapes.txt'
 
-        min_distance = 1000000000
-        min_index = -1
-        closestLat = 0
-        closestLon = 0
+        if cache.path != shapes_path:
+            cache.open(shapes_path)
 
-        for i in range(len(self.waypoint_list) - 1):
-            sp1 = self.waypoint_list[i]
-            sp2 = self.waypoint_list[i + 1]
+        return cache.get(self)
 
-            distance = geo_util.get_min_distance(sp1, sp2, lat, lon, seconds)
+    # returns the predicted time of `trip` at way point `index` of `count`, assuming
+    # way points are evenly spaced in time over the segment
+    def get_way_point_time(self, trip, index, count):
+        start_time, end_time = self.get_times(trip)
+        return int(start_time + index / count * (end_time - start_time))
 
-            if distance < min_distance:
-                min_distance = distance
-                min_index = i
-                closestLat = self.waypoint_list[i]['lat']
-                closestLon = self.waypoint_list[i]['lon']
+    def get_score(self, trip, lat, lon, seconds, path):
+        start, end = self.get_time_window(trip)
 
-        print(f'- min_distance: {min_distance}')
+        if not self.contains(lat, lon) or seconds < start or seconds > end:
+            return {'score': -1, 'time_offset': 0}
+
+        lats, lons, xs, ys = self.get_way_points(path)
+        x, y = self.projection.get_xy(lat, lon)
+
+        min_distance, min_index = geo_util.get_min_planar_distance(x, y, xs, ys)
+
+        logger.debug('- min_distance: %s', min_distance)
 
+        return self.make_score(trip, seconds, min_distance, lats[min_index], lons[min_index], self.get_way_point_time(trip, min_index, len(lats)))
+
+    # turns the distance to the closest way point and `trip`'s predicted time at that way point into a score
+    def make_score(self, trip, seconds, min_distance, closestLat, closestLon, closestTime):
         if min_distance > MAX_LOCATION_DISTANCE:
             return {'score': -1, 'time_offset': 0}
 
-        print(f'+ update time : {util.seconds_to_hhmm(seconds)}')
-        print(f'+ segment time: {util.seconds_to_hhmm(self.waypoint_list[min_index]["time"])}')
-        time_distance = abs(seconds - self.waypoint_list[min_index]['time'])
-        print(f'- time_distance: {time_distance}')
+        if logger.is_enabled(log.DEBUG):
+            logger.debug('+ update time : %s', util.seconds_to_hhmm(seconds))
+            logger.debug('+ segment time: %s', util.seconds_to_hhmm(closestTime))
+        time_distance = abs(seconds - closestTime)
+        logger.debug('- time_distance: %s', time_distance)
 
         if time_distance > MAX_TIME_DISTANCE:
             return {'score': -1, 'time_offset': 0}
@@ -116,13 +261,141 @@ class Segment:
         location_score = .5 * (MAX_LOCATION_DISTANCE - min_distance) / MAX_LOCATION_DISTANCE
         time_score = .5 * (MAX_TIME_DISTANCE - time_distance) / MAX_TIME_DISTANCE
 
-        util.debug(f'segment update: id={self.id} trip-name={util.to_b64(self.trip_name)} score={location_score + time_score} trip_pos=({self.segment_index}/{self.segments_per_trip}) closest-lat={closestLat} closest-lon={closestLon}')
-        util.debug(f'+ trip_name: {self.trip_name}')
+        if log.is_result_enabled(log.SEGMENT_UPDATE):
+            log.result(log.SEGMENT_UPDATE, {
+                'id': self.id,
+                'trip-name': util.to_b64(trip.name),
+                'score': location_score + time_score,
+                'trip_pos': f'({self.segment_index}/{self.segments_per_trip})',
+                'closest-lat': closestLat,
+                'closest-lon': closestLon
+            })
+
+        logger.debug('+ trip_name: %s', trip.name)
 
         return {
             'score': location_score + time_score,
-            'time_offset': seconds - self.waypoint_list[min_index]['time']
+            'time_offset': seconds - closestTime
         }
 
-    def get_trip_id(self):
-        return self.trip_id
+"""
+Time interval index and bounding boxes of a fixed list of segments, typically
+those of one grid cell. Segments are kept sorted by the start of the earliest
+time window of their trips, see Segment.get_time_window(). With `max_window` being the longest
+window in the list, only segments with a window start in
+[seconds - max_window, seconds] can cover `seconds`, and those form a single
+range of the sorted list that is found by bisection. The remaining checks on
+window end and bounding box run over that range only, vectorized with NumPy
+where the range is large enough.
+"""
+class SegmentBatch:
+    def __init__(self, segment_list):
+        windows = [s.get_time_window() for s in segment_list]
+        order = sorted(range(len(segment_list)), key = lambda i: windows[i][0])
+
+        self.segments = [segment_list[i] for i in order]
+        # position of each segment in `segment_list`, to return candidates in that order
+        self.positions = order
+        self.window_starts = [windows[i][0] for i in order]
+        self.window_ends = [windows[i][1] for i in order]
+        self.max_window = max([e - s for s, e in windows], default = 0)
+        self.arrays = None
+
+        if util.np is None or len(segment_list) < util.NUMPY_MIN_SIZE:
+            return
+
+        np = util.np
+        count = len(segment_list)
+        min_lat = np.empty(count)
+        max_lat = np.empty(count)
+        min_lon = np.empty(count)
+        max_lon = np.empty(count)
+
+        for i, s in enumerate(self.segments):
+            min_lat[i] = s.min_lat
+            max_lat[i] = s.max_lat
+            min_lon[i] = s.min_lon
+            max_lon[i] = s.max_lon
+
+        self.arrays = (min_lat, max_lat, min_lon, max_lon, np.array(self.window_ends, dtype=np.int64))
+
+    # returns (lo, hi) such that only self.segments[lo:hi] can have a time window covering `seconds`
+    def get_time_range(self, seconds):
+        lo = bisect_left(self.window_starts, seconds - self.max_window)
+        hi = bisect_right(self.window_starts, seconds, lo)
+        return (lo, hi)
+
+    # returns the segments containing lat/lon with a trip time window that may cover `seconds`, in list order
+    def get_candidates(self, lat, lon, seconds):
+        lo, hi = self.get_time_range(seconds)
+
+        if self.arrays is None or hi - lo < util.NUMPY_MIN_SIZE:
+            hits = [i for i in range(lo, hi) if self.window_ends[i] >= seconds and self.segments[i].contains(lat, lon)]
+        else:
+            min_lat, max_lat, min_lon, max_lon, window_ends = self.arrays
+            mask = ((min_lat[lo:hi] <= lat) & (max_lat[lo:hi] >= lat) & (min_lon[lo:hi] <= lon)
+                & (max_lon[lo:hi] >= lon) & (window_ends[lo:hi] >= seconds))
+            hits = (util.np.flatnonzero(mask) + lo).tolist()
+
+        hits.sort(key = lambda i: self.positions[i])
+        return [self.segments[i] for i in hits]
+
+"""
+Scores all segments in `segment_list` for a single GPS update. The distance from
+lat/lon to a segment is computed once and then scored against the predicted time
+of each of the segment's trips with a time window covering `seconds`, optionally
+limited to services in `active_services` and trip IDs in `trip_ids`. Returns a
+list of (segment, trip, {'score', 'time_offset'}) tuples, one per segment and trip
+looked at, with the same results as calling segment.get_score() for the trip.
+With NumPy available, the way points of all segments that pass the bounding box
+check and have a trip in time are stacked into one set of arrays and their
+polyline distances are computed in a single vectorized pass.
+"""
+def get_scores(segment_list, lat, lon, seconds, path, active_services = None, trip_ids = None):
+    results = []
+    candidates = []
+    point_count = 0
+
+    for s in segment_list:
+        if not s.contains(lat, lon):
+            continue
+
+        trips = s.get_trips(seconds, active_services, trip_ids)
+
+        if len(trips) == 0:
+            continue
+
+        wp = s.get_way_points(path)
+        candidates.append((s, trips, wp))
+        point_count += len(wp[0])
+
+    if len(candidates) == 0:
+        return results
+
+    if util.np is None or point_count < util.NUMPY_MIN_SIZE:
+        distances = []
+
+        for s, trips, wp in candidates:
+            x, y = s.projection.get_xy(lat, lon)
+            distances.append(geo_util.get_min_planar_distance(x, y, wp[2], wp[3]))
+    else:
+        np = util.np
+        xs = np.concatenate([np.frombuffer(wp[2], dtype=np.float64) for s, trips, wp in candidates])
+        ys = np.concatenate([np.frombuffer(wp[3], dtype=np.float64) for s, trips, wp in candidates])
+        starts = np.zeros(len(candidates), dtype=np.int64)
+        np.cumsum([len(wp[0]) for s, trips, wp in candidates[:-1]], out=starts[1:])
+
+        # all segments of a feed share the projection of the agency area
+        x, y = candidates[0][0].projection.get_xy(lat, lon)
+        min_distances, min_indices = geo_util.get_min_planar_distances(x, y, xs, ys, starts)
+        distances = zip(min_distances.tolist(), min_indices.tolist())
+
+    for (s, trips, wp), (min_distance, min_index) in zip(candidates, distances):
+        lats, lons, xs, ys = wp
+        logger.debug('- min_distance: %s', min_distance)
+
+        for trip in trips:
+            closest_time = s.get_way_point_time(trip, min_index, len(lats))
+            results.append((s, trip, s.make_score(trip, seconds, min_distance, lats[min_index], lons[min_index], closest_time)))
+
+    return results
@@ -0,0 +1,99 @@
+import datetime
+import log
+
+DOW_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DEFAULT_PERIOD_DAYS = 365
+
+logger = log.get_logger('service_calendar')
+
+"""
+Service activation index built from calendar.txt and calendar_dates.txt.
+Each service_id maps to a bitmap (a python int) with bit i set if the
+service runs on day `first_day + i`, where days are proleptic Gregorian
+ordinals as returned by date.toordinal(). Weekly patterns are expanded
+over the service's start_date..end_date period first, then calendar_dates
+exceptions add (type 1) or remove (type 2) individual dates.
+"""
+class ServiceCalendar:
+    def __init__(self, calendar_rows, calendar_date_rows):
+        calendar_rows = list(calendar_rows)
+        calendar_date_rows = list(calendar_date_rows)
+        self.bitmaps = {}
+        # inference asks for the same date on every update, so only the last one is cached
+        self.active_day = None
+        self.active_services = None
+
+        days = []
+        for r in calendar_rows:
+            for name in ['start_date', 'end_date']:
+                s = r.get(name, None)
+                if s is not None and len(s) > 0:
+                    days.append(get_day(s))
+        for r in calendar_date_rows:
+            days.append(get_day(r['date']))
+
+        # services without an explicit period are assumed to run over the period covered by the feed
+        if len(days) == 0:
+            today = datetime.date.today().toordinal()
+            days = [today, today + DEFAULT_PERIOD_DAYS]
+
+        self.first_day = min(days)
+        self.last_day = max(days)
+
+        for r in calendar_rows:
+            service_id = r['service_id']
+            cal = [int(r[d]) for d in DOW_NAMES]
+            start_date = r.get('start_date', None)
+            end_date = r.get('end_date', None)
+            start_day = self.first_day if start_date is None or len(start_date) == 0 else get_day(start_date)
+            end_day = self.last_day if end_date is None or len(end_date) == 0 else get_day(end_date)
+            bits = 0
+
+            for day in range(start_day, end_day + 1):
+                if cal[datetime.date.fromordinal(day).weekday()] == 1:
+                    bits |= 1 << (day - self.first_day)
+
+            self.bitmaps[service_id] = bits
+
+        for r in calendar_date_rows:
+            service_id = r['service_id']
+            bit = 1 << (get_day(r['date']) - self.first_day)
+            bits = self.bitmaps.get(service_id, 0)
+
+            if r['exception_type'] == '1':
+                bits |= bit
+            elif r['exception_type'] == '2':
+                bits &= ~bit
+
+            self.bitmaps[service_id] = bits
+
+    def is_active(self, service_id, date):
+        offset = date.toordinal() - self.first_day
+
+        if offset < 0:
+            return False
+
+        return (self.bitmaps.get(service_id, 0) >> offset) & 1 == 1
+
+    # returns the set of service IDs running on `date`
+    def get_active_services(self, date):
+        day = date.toordinal()
+
+        if day != self.active_day:
+            self.active_services = set(id for id in self.bitmaps if self.is_active(id, date))
+            self.active_day = day
+            logger.debug('- active services for %s: %s', date, self.active_services)
+
+        return self.active_services
+
+    def __contains__(self, service_id):
+        return service_id in self.bitmaps
+
+    def __str__(self):
+        first = datetime.date.fromordinal(self.first_day)
+        last = datetime.date.fromordinal(self.last_day)
+        return f'{{services: {len(self.bitmaps)}, first_day: {first}, last_day: {last}}}'
+
+# converts a GTFS yyyymmdd date string to a day ordinal
+def get_day(yyyymmdd):
+    return datetime.datetime.strptime(yyyymmdd, '%Y%m%d').date().toordinal()
@@ -1,4 +1,6 @@
 class ShapePoint:
+    __slots__ = ('lat', 'lon')
+
     def __init__(self, lat = None, lon = None):
         self.lat = lat
         self.lon = lon
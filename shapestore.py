@@ -0,0 +1,103 @@
+from array import array
+from itertools import accumulate
+import math
+import util
+
+NO_VALUE = float('nan')
+NO_TIME = -1
+
+"""
+Columnar storage for shape points. Instead of one dict per point, each shape
+keeps contiguous arrays of lat, lon, byte offset in shapes.txt, cumulative
+distance in feet, shape_dist_traveled and predicted arrival time, all indexed
+by position within the shape. Missing shape_dist_traveled values are stored as
+NaN, unset times as NO_TIME.
+"""
+class Shape:
+    def __init__(self, shape_id):
+        self.shape_id = shape_id
+        self.lat = array('d')
+        self.lon = array('d')
+        self.file_offset = array('q')
+        self.distance = array('d')
+        self.traveled = array('d')
+        self.time = array('l')
+        self.annotated = True
+
+    def append(self, lat, lon, file_offset, distance = 0, traveled = NO_VALUE):
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.file_offset.append(file_offset)
+        self.distance.append(distance)
+        self.traveled.append(traveled)
+        self.time.append(NO_TIME)
+
+        if math.isnan(traveled):
+            self.annotated = False
+
+    # recomputes cumulative distances along the shape from point coordinates
+    def update_distances(self):
+        if len(self.lat) == 0:
+            return
+
+        legs = util.haversine_distances(self.lat, self.lon)
+        self.distance = array('d', [0.0])
+
+        if util.np is not None and isinstance(legs, util.np.ndarray):
+            self.distance.extend(util.np.cumsum(legs).tolist())
+        else:
+            self.distance.extend(accumulate(legs))
+
+    # True if every point has a shape_dist_traveled value
+    def is_annotated(self):
+        return self.annotated and len(self.traveled) > 0
+
+    def clear_times(self):
+        for i in range(len(self.time)):
+            self.time[i] = NO_TIME
+
+    def get_length(self):
+        if len(self.distance) == 0:
+            return 0
+        return self.distance[-1]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def get_memory_size(self):
+        size = 0
+
+        for a in (self.lat, self.lon, self.file_offset, self.distance, self.traveled, self.time):
+            size += a.itemsize * len(a)
+
+        return size
+
+class ShapeStore:
+    def __init__(self):
+        self.shapes = {}
+
+    def get_shape(self, shape_id):
+        return self.shapes.get(shape_id, None)
+
+    def get_or_create_shape(self, shape_id):
+        shape = self.shapes.get(shape_id, None)
+
+        if shape is None:
+            shape = Shape(shape_id)
+            self.shapes[shape_id] = shape
+
+        return shape
+
+    def __iter__(self):
+        return iter(self.shapes)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def get_point_count(self):
+        count = 0
+
+        for shape_id in self.shapes:
+            count += len(self.shapes[shape_id])
+
+        return count
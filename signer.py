@@ -0,0 +1,52 @@
+import json
+import threading
+import time
+import util
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Signs messages for upload on a worker thread, so that signing a message overlaps
+with posting the previous one rather than adding to the latency of the stage that
+builds it. A single worker keeps signatures in submission order; ECDSA in pure
+Python holds the GIL, so more workers (or a process, on a single core Pi) wouldn't
+sign any faster.
+
+`sk` is loaded once and reused for all messages. Loading it derives the public key,
+which also builds ecdsa's multiplication table for the curve generator that each
+signature then uses.
+"""
+class Signer:
+    def __init__(self, sk):
+        self.sk = sk
+        self.lock = threading.Lock()
+        self.count = 0
+        self.seconds = 0
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'signer')
+
+    """
+    Returns `msg` and its signature as posted, i.e. {"data":<msg>,"sig":<signature>}
+    in compact JSON. `msg` is serialized once, and the same string is signed and
+    embedded, so the server sees exactly the bytes that were signed.
+    """
+    def sign(self, msg):
+        start = time.perf_counter()
+        data = json.dumps(msg, separators=(',', ':'))
+        sig = util.sign(data, self.sk)
+        result = ('{"data":' + data + ',"sig":' + json.dumps(sig) + '}').encode('utf-8')
+
+        with self.lock:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+        return result
+
+    # returns a future for sign(msg)
+    def submit(self, msg):
+        return self.executor.submit(self.sign, msg)
+
+    def __str__(self):
+        with self.lock:
+            return f'{{signatures: {self.count}, avg: {1000 * self.seconds / max(self.count, 1):.2f} ms}}'
+
+    def close(self):
+        self.executor.shutdown()
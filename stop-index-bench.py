@@ -0,0 +1,109 @@
+"""
+Compares per-update stop lookup cost of the StopIndex spatial hash against a
+brute-force scan over all stops, for synthetic stop sets of increasing size:
+
+    python stop-index-bench.py [<stop-count>...]
+
+If a GTFS archive is given instead, the stops from its stops.txt are used:
+
+    python stop-index-bench.py ~/tmp/gtfs-cache/gtfs.zip
+"""
+
+import os
+import platform
+import random
+import sys
+import time
+import util
+from stopindex import StopIndex
+
+LAT = 36.2
+LON = -119.3
+STOP_PROXIMITY = 150
+QUERY_COUNT = 500
+CHECK_COUNT = 50
+
+def get_random_stops(count):
+    # keep stop density roughly constant, like a larger agency covering more ground
+    span = .005 * count ** .5
+    stops = {}
+
+    for i in range(count):
+        lat = LAT + random.uniform(-span, span)
+        lon = LON + random.uniform(-span, span)
+        stops[f'stop-{i}'] = {'lat': lat, 'long': lon}
+
+    return stops
+
+def get_feed_stops(zip_path):
+    stops = {}
+
+    for r in platform.read_zip_table(zip_path, 'stops.txt', False, ['stop_id', 'stop_lat', 'stop_lon']):
+        stops[r['stop_id']] = {'lat': float(r['stop_lat']), 'long': float(r['stop_lon'])}
+
+    return stops
+
+# previous approach: first stop within max_distance
+def brute_force(stops, lat, lon, max_distance):
+    for id in stops:
+        s = stops[id]
+        if util.haversine_distance(lat, lon, s['lat'], s['long']) < max_distance:
+            return id
+    return None
+
+# positions near random stops, so that a good fraction of queries have a hit
+def get_queries(stops):
+    ids = list(stops)
+    queries = []
+
+    for i in range(QUERY_COUNT):
+        s = stops[random.choice(ids)]
+        queries.append((s['lat'] + random.uniform(-.001, .001), s['long'] + random.uniform(-.001, .001)))
+
+    return queries
+
+def run(fn, queries):
+    start = time.perf_counter()
+
+    for lat, lon in queries:
+        fn(lat, lon)
+
+    return (time.perf_counter() - start) / len(queries) * 1000000
+
+def bench(name, stops):
+    start = time.perf_counter()
+    index = StopIndex(stops)
+    build_ms = (time.perf_counter() - start) * 1000
+    queries = get_queries(stops)
+
+    t_brute = run(lambda lat, lon: brute_force(stops, lat, lon, STOP_PROXIMITY), queries)
+    t_nearest = run(lambda lat, lon: index.get_nearest(lat, lon, STOP_PROXIMITY), queries)
+    t_within = run(lambda lat, lon: index.get_stops_within(lat, lon, STOP_PROXIMITY), queries)
+
+    # nearest stop found by the index must match an exhaustive search
+    for lat, lon in queries[:CHECK_COUNT]:
+        best = min(stops, key = lambda id: util.haversine_distance(lat, lon, stops[id]['lat'], stops[id]['long']))
+        d = util.haversine_distance(lat, lon, stops[best]['lat'], stops[best]['long'])
+        id, distance = index.get_nearest(lat, lon, STOP_PROXIMITY)
+        assert (d >= STOP_PROXIMITY and id is None) or distance == d, f'mismatch at {lat}, {lon}'
+
+    print(f'{name:>10} {len(stops):>8} {build_ms:>10.1f} {t_brute:>12.1f} {t_nearest:>10.1f} {t_within:>10.1f}')
+
+def main(args):
+    print(f'{"stops":>10} {"count":>8} {"build ms":>10} {"brute force":>12} {"nearest":>10} {"within":>10}')
+
+    if len(args) == 1 and os.path.isfile(args[0]):
+        bench('feed', get_feed_stops(args[0]))
+    else:
+        sizes = [int(a) for a in args]
+
+        if len(sizes) == 0:
+            sizes = [100, 1000, 10000, 100000]
+
+        for count in sizes:
+            bench('random', get_random_stops(count))
+
+    print('(query times in microseconds per update)')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
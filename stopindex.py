@@ -0,0 +1,78 @@
+import math
+import util
+
+DEFAULT_CELL_SIZE = 500 # feet
+
+"""
+Spatial hash over stop locations. Stops are bucketed into square cells of
+`cell_size` feet, using an equirectangular approximation centered on the
+mean stop latitude. Queries only look at the cells overlapping the search
+radius and then filter by exact haversine distance, so their cost depends
+on local stop density rather than on the total number of stops.
+"""
+class StopIndex:
+    def __init__(self, stops, cell_size = DEFAULT_CELL_SIZE):
+        self.stops = stops
+        self.cell_size = cell_size
+        self.cells = {}
+
+        lat_sum = 0
+        for id in stops:
+            lat_sum += stops[id]['lat']
+
+        ref_lat = lat_sum / len(stops) if len(stops) > 0 else 0
+        self.lat_scale = util.FEET_PER_LAT_DEGREE / cell_size
+        self.lon_scale = util.FEET_PER_LAT_DEGREE * math.cos(math.radians(ref_lat)) / cell_size
+
+        for id in stops:
+            stop = stops[id]
+            key = self.get_key(stop['lat'], stop['long'])
+            cell = self.cells.get(key, None)
+
+            if cell is None:
+                cell = []
+                self.cells[key] = cell
+
+            cell.append(id)
+
+    def get_key(self, lat, lon):
+        return (math.floor(lat * self.lat_scale), math.floor(lon * self.lon_scale))
+
+    # returns list of (stop_id, distance) tuples for all stops within
+    # `radius` feet from lat/lon, ordered by increasing distance
+    def get_stops_within(self, lat, lon, radius):
+        row, col = self.get_key(lat, lon)
+        # slightly oversize the search window so that the approximate
+        # projection never excludes a stop that is in range
+        n = math.ceil(1.1 * radius / self.cell_size)
+        result = []
+
+        for r in range(row - n, row + n + 1):
+            for c in range(col - n, col + n + 1):
+                cell = self.cells.get((r, c), None)
+
+                if cell is None:
+                    continue
+
+                for id in cell:
+                    stop = self.stops[id]
+                    distance = util.haversine_distance(lat, lon, stop['lat'], stop['long'])
+
+                    if distance < radius:
+                        result.append((id, distance))
+
+        result.sort(key = lambda e: e[1])
+        return result
+
+    # returns (stop_id, distance) for the stop closest to lat/lon
+    # within `max_distance` feet, (None, inf) if there is none
+    def get_nearest(self, lat, lon, max_distance):
+        result = self.get_stops_within(lat, lon, max_distance)
+
+        if len(result) == 0:
+            return (None, float('inf'))
+
+        return result[0]
+
+    def __str__(self):
+        return f'{{stops: {len(self.stops)}, cells: {len(self.cells)}, cell_size: {self.cell_size}}}'
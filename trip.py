@@ -0,0 +1,40 @@
+"""
+Start and end times of each segment of a shape relative to the start of a trip.
+Trips that run over the same shape with the same running times, and only differ
+in their departure time, share a single TimePattern.
+"""
+class TimePattern:
+    __slots__ = ('shape_id', 'starts', 'ends')
+
+    def __init__(self, shape_id, starts, ends):
+        self.shape_id = shape_id
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+"""
+A scheduled trip: its departure time (arrival at the first stop, in seconds since
+midnight) and the time pattern of its shape. Segments of a shape are shared by all
+trips running over it, segment times of a trip are derived from its pattern.
+"""
+class Trip:
+    __slots__ = ('id', 'name', 'service_id', 'start_seconds', 'pattern')
+
+    def __init__(self, trip_id, name, service_id, start_seconds, pattern):
+        self.id = trip_id
+        self.name = name
+        self.service_id = service_id
+        self.start_seconds = start_seconds
+        self.pattern = pattern
+
+    def get_shape_id(self):
+        return self.pattern.shape_id
+
+    # returns (start, end) seconds since midnight of the segment at `position` in its shape
+    def get_segment_times(self, position):
+        return (self.start_seconds + self.pattern.starts[position], self.start_seconds + self.pattern.ends[position])
+
+    def __str__(self):
+        return f'{{id: {self.id}, name: {self.name}, service_id: {self.service_id}, start_seconds: {self.start_seconds}, segments: {len(self.pattern)}}}'
@@ -0,0 +1,86 @@
+"""
+Times position-sized uploads to a server, one requests.post() per upload as
+send_data() used to do, against the pooled keep-alive Uploader, e.g.:
+
+    python mock-server.py -d 20
+    python upload-bench.py https://localhost:8443/ 50 /tmp/tmpXXXX/cert.pem
+
+The last argument is the certificate to verify the server with, for a server
+with a self-signed certificate like mock-server.py.
+"""
+
+import json
+import log
+import requests
+import sys
+import time
+from uploader import Uploader, UploadStats
+
+ENDPOINT = 'new-pos-sig'
+
+def get_payload():
+    msg = {
+        'uuid': '00000000-0000-0000-0000-000000000000',
+        'agent': 'raspberry bench graas 0.1 (gulper)',
+        'timestamp': int(time.time()),
+        'lat': 37.7749,
+        'long': -122.4194,
+        'speed': 5.2,
+        'heading': 180,
+        'accuracy': 4.1,
+        'trip-id': 'bench-trip-id',
+        'agency-id': 'bench-agency',
+        'vehicle-id': 'bench-vehicle',
+        'pos-timestamp': int(time.time())
+    }
+
+    obj = {
+        'data': msg,
+        'sig': 'x' * 96
+    }
+
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def run_unpooled(url, count, verify, data):
+    stats = UploadStats()
+    headers = {'Content-Type': 'application/json'}
+
+    for i in range(count):
+        start = time.perf_counter()
+        resp = requests.post(url + ENDPOINT, data = data, headers = headers, timeout = 5, verify = verify)
+        elapsed = time.perf_counter() - start
+        stats.record(elapsed, 0, elapsed, len(data), resp.status_code == 200)
+
+    return stats
+
+def run_pooled(url, count, verify, data):
+    uploader = Uploader(url, verify = verify)
+
+    for i in range(count):
+        uploader.post(ENDPOINT, data)
+
+    uploader.close()
+    return uploader.stats
+
+def main(url, count, verify):
+    data = get_payload()
+
+    for name, run in [('requests.post', run_unpooled), ('Uploader', run_pooled)]:
+        start = time.perf_counter()
+        stats = run(url, count, verify, data)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<14} {count / elapsed:6.1f} uploads/s {stats}')
+
+    print('(requests.post doesn\'t split out connect and tls, its connect is the whole request)')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'usage: {sys.argv[0]} <server-url> <count> [<cert-file>]')
+        exit(1)
+
+    url = sys.argv[1]
+    if url.rfind('/') != len(url) - 1:
+        url += '/'
+
+    log.set_level(log.WARNING)
+    main(url, int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else True)
@@ -0,0 +1,167 @@
+import gzip
+import json
+import log
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 5 # seconds
+READ_TIMEOUT = 10 # seconds
+POOL_SIZE = 2
+RETRIES = 2
+BACKOFF_FACTOR = .5
+RETRY_STATUS = [502, 503, 504]
+
+logger = log.get_logger('uploader')
+
+# connect timings of the connection most recently opened by the current thread
+connect_times = threading.local()
+
+def get_connect_times():
+    tcp = getattr(connect_times, 'tcp', 0)
+    tls = getattr(connect_times, 'tls', 0)
+    connect_times.tcp = 0
+    connect_times.tls = 0
+    return tcp, tls
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        conn = super()._new_conn()
+        connect_times.tcp = time.perf_counter() - start
+        return conn
+
+# connect() opens the socket through _new_conn() and then does the TLS handshake
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        conn = super()._new_conn()
+        connect_times.tcp = time.perf_counter() - start
+        return conn
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        connect_times.tls = time.perf_counter() - start - connect_times.tcp
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+"""
+Per request timings in seconds. `connect` and `tls` are 0 for requests that went out
+over a kept-alive connection, `response` is the time from sending the request to
+the complete response.
+"""
+class UploadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self.connect = 0
+        self.tls = 0
+        self.response = 0
+        self.max_response = 0
+        self.bytes_sent = 0
+
+    def record(self, connect, tls, response, size, ok):
+        with self.lock:
+            self.requests += 1
+            if not ok:
+                self.failures += 1
+            if connect > 0:
+                self.connections += 1
+                self.connect += connect
+                self.tls += tls
+            self.response += response
+            self.max_response = max(self.max_response, response)
+            self.bytes_sent += size
+
+    def __str__(self):
+        with self.lock:
+            connections = max(self.connections, 1)
+            requests = max(self.requests, 1)
+
+            return (f'{{requests: {self.requests} ({self.failures} failed), connections: {self.connections}, '
+                + f'connect: {1000 * self.connect / connections:.1f}ms avg, tls: {1000 * self.tls / connections:.1f}ms avg, '
+                + f'response: {1000 * self.response / requests:.1f}ms avg, {1000 * self.max_response:.1f}ms max, '
+                + f'bytes_sent: {self.bytes_sent}}}')
+
+"""
+Posts JSON to a server over a persistent session, so that consecutive uploads reuse
+the same keep-alive TCP and TLS connection instead of setting up a new one each time.
+Failed connects and 502/503/504 responses are retried with exponential backoff.
+Requests that reached the server and timed out are not retried, to avoid duplicate
+uploads. Safe to use from multiple threads.
+"""
+class Uploader:
+    def __init__(self, url, connect_timeout = CONNECT_TIMEOUT, read_timeout = READ_TIMEOUT, retries = RETRIES, verify = True):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = UploadStats()
+
+        retry = Retry(
+            total = retries,
+            connect = retries,
+            read = 0,
+            status = retries,
+            backoff_factor = BACKOFF_FACTOR,
+            status_forcelist = RETRY_STATUS,
+            allowed_methods = frozenset(['POST']),
+            raise_on_status = False
+        )
+
+        adapter = TimedHTTPAdapter(pool_connections = 1, pool_maxsize = POOL_SIZE, max_retries = retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        # passed per request, a session level setting loses against REQUESTS_CA_BUNDLE
+        self.verify = verify
+
+    # posts `data` (bytes) to `endpoint`, gzip'ed if `compress` is set. Returns the response
+    # or None if the request failed
+    def post(self, endpoint, data, compress = False):
+        resp = None
+        headers = None
+
+        if compress:
+            data = gzip.compress(data)
+            headers = {'Content-Encoding': 'gzip'}
+
+        get_connect_times()
+        start = time.perf_counter()
+
+        try:
+            resp = self.session.post(self.url + endpoint, data = data, headers = headers, timeout = self.timeout, verify = self.verify)
+        except requests.exceptions.RequestException as e:
+            logger.warning('post to %s failed: %s', endpoint, e)
+
+        elapsed = time.perf_counter() - start
+        tcp, tls = get_connect_times()
+        ok = resp is not None and resp.status_code == 200
+        self.stats.record(tcp, tls, elapsed - tcp - tls, len(data), ok)
+        logger.debug('%s: %s, connect %.1fms, tls %.1fms, total %.1fms', endpoint, None if resp is None else resp.status_code, 1000 * tcp, 1000 * tls, 1000 * elapsed)
+
+        return resp
+
+    def post_json(self, endpoint, obj):
+        return self.post(endpoint, json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+
+    def close(self):
+        self.session.close()
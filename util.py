@@ -8,15 +8,25 @@ from datetime import datetime
 import sys
 import random
 import platform
+import log
 from shapepoint import ShapePoint
 from zipfile import ZipFile
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 EARTH_RADIUS_IN_FEET = 20902231
 FEET_PER_LAT_DEGREE = 364000
 FEET_PER_LONG_DEGREE = 288200
 FEET_PER_MILE = 5280
 
+# below this many points, plain Python beats NumPy call overhead
+NUMPY_MIN_SIZE = 48
+
 debug_callback = None
+app_logger = log.get_logger('app')
 
 # UI colors
 LIGHT            = 'ffc0c0c0'
@@ -148,6 +158,59 @@ def haversine_distance(lat1, lon1, lat2, lon2):
 
     return EARTH_RADIUS_IN_FEET * c
 
+def use_numpy(values):
+    return np is not None and len(values) >= NUMPY_MIN_SIZE
+
+def numpy_haversine_distance(lat1, lon1, lat2, lon2):
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = np.radians(lat2 - lat1)
+    delta_lam = np.radians(lon2 - lon1)
+
+    s1 = np.sin(delta_phi / 2)
+    s2 = np.sin(delta_lam / 2)
+    a = s1 * s1 + np.cos(phi1) * np.cos(phi2) * s2 * s2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_IN_FEET * c
+
+# batch versions of haversine_distance(). Coordinates can be given as lists,
+# array.array or NumPy arrays. Results are NumPy arrays if NumPy is installed
+# and the input is large enough, lists otherwise
+
+# returns the len(lats) - 1 distances in feet between consecutive points
+def haversine_distances(lats, lons):
+    if use_numpy(lats):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return numpy_haversine_distance(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+    return [haversine_distance(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(len(lats) - 1)]
+
+# returns the distances in feet from (lat, lon) to each of the given points
+def haversine_distances_from(lat, lon, lats, lons):
+    if use_numpy(lats):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return numpy_haversine_distance(lat, lon, lats, lons)
+
+    return [haversine_distance(lat, lon, lats[i], lons[i]) for i in range(len(lats))]
+
+# returns (distance, index) of the point closest to (lat, lon), (inf, -1) for no points.
+# Ties resolve to the lowest index
+def haversine_min_distance(lat, lon, lats, lons):
+    if len(lats) == 0:
+        return (float('inf'), -1)
+
+    d = haversine_distances_from(lat, lon, lats, lons)
+
+    if np is not None and isinstance(d, np.ndarray):
+        i = int(np.argmin(d))
+    else:
+        i = min(range(len(d)), key=d.__getitem__)
+
+    return (float(d[i]), i)
+
 def distance(x0, y0, x1, y1):
     xd = x1 - x0
     yd = y1 - y0
@@ -164,18 +227,15 @@ def set_debug_callback(cb):
     global debug_callback
     debug_callback = cb
 
+# general purpose console output at log.INFO level of logger 'app', see log.py
 def debug(s):
-    ts = datetime.now().strftime('%H:%M:%S ')
-
     if debug_callback is None:
-        print(ts + str(s))
-        sys.stdout.flush()
+        app_logger.info(s)
     else:
         debug_callback(s)
 
 def error(s):
-    print(f'*** {s}')
-    sys.stdout.flush()
+    app_logger.error(s)
 
 def early_exit():
     error('early exit')
@@ -237,6 +297,28 @@ def get_property(filename, name):
     return None
 
 
+# returns the sha256 hex digest of the cached gtfs.zip. The digest is
+# computed once per feed and kept next to the archive
+def get_feed_hash(cache_path):
+    hash_file = cache_path + 'gtfs.zip.sha256'
+
+    if platform.resource_exists(hash_file):
+        return platform.read_file(hash_file).strip()
+
+    h = sha256()
+
+    with platform.get_binary_file_contents(cache_path + 'gtfs.zip') as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+
+    digest = h.hexdigest()
+    platform.write_to_file(hash_file, digest.encode('utf-8'))
+    return digest
+
+# returns True if a new gtfs.zip was installed in `cache_path`, False otherwise
 def update_cache_if_needed(cache_path, url):
     debug(f'update_cache_if_needed()')
     debug(f'- cache_path: {cache_path}')
@@ -255,7 +337,7 @@ def update_cache_if_needed(cache_path, url):
 
         if url_time is None:
             debug(f'* can\'t access static GTFS URL {url}, aborting cache update')
-            return
+            return False
 
         url_date = datetime.strptime(url_time, '%a, %d %b %Y %H:%M:%S %Z')
         file_date = datetime.fromtimestamp(0, url_date.tzinfo)
@@ -264,7 +346,7 @@ def update_cache_if_needed(cache_path, url):
 
         if datetime.timestamp(url_date) <= datetime.timestamp(file_date):
             debug('+ gtfs.zip up-to-date, nothing to do')
-            return
+            return False
 
         debug('+ gtfs.zip out of date, downloading...')
 
@@ -283,11 +365,16 @@ def update_cache_if_needed(cache_path, url):
 
         if ts_archive < ts_cache:
             debug('+ gtfs.zip up-to-date, nothing to do')
-            return
+            return False
 
         platform.copy_file(url, file_name)
 
     debug('+ gtfs.zip downloaded')
-    names = ['calendar.txt', 'routes.txt', 'stops.txt', 'stop_times.txt', 'shapes.txt', 'trips.txt']
+    # all other tables are read straight out of gtfs.zip, but segments
+    # need random access to shape points by file offset
+    names = ['shapes.txt']
     platform.unpack_zip(file_name, cache_path, names)
+    platform.remove_resource(file_name + '.sha256')
+
+    return True
 